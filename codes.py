@@ -67,6 +67,19 @@ class Code(object):
         parts.extend(f'{k}={v}' for k, v in self.parameters.items())
         return f'<Code({", ".join(parts)})>'
 
+    def copy(self, parameters=None):
+        """ Cheap copy of the code with its own parameter dictionary, or the one given, bypassing __init__.
+        >>> a = Code("G0", X=1)
+        >>> b = a.copy()
+        >>> b.parameters['X'] = 2
+        >>> a, b, a.copy({'Y': 3})
+        (<Code(code=G0, X=1)>, <Code(code=G0, X=2)>, <Code(code=G0, Y=3)>)
+        """
+        clone = object.__new__(Code)
+        clone.__dict__.update(self.__dict__)
+        clone.parameters = dict(self.parameters) if parameters is None else parameters
+        return clone
+
     def override(self, **kwargs):
         """ Explicitly override various parameters by identifier.
         >>> Code("A123", T=1).override(T=2).parameters
@@ -5,8 +5,9 @@ import time
 
 class Connection:
 
-    def __init__(self, comport, baudrate):
+    def __init__(self, comport, baudrate, on_response=None):
         self.conn = serial.Serial(comport, baudrate, timeout=0.1)
+        self.on_response = on_response
         self.thread = threading.Thread(target=reader, args=(self,))
         self.listening = False
 
@@ -46,4 +47,6 @@ def reader(conn: Connection):
             return
         if text:
             print("<<", text)
+            if conn.on_response:
+                conn.on_response(text.decode(errors='replace').strip())
 
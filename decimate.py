@@ -0,0 +1,272 @@
+#! *python3:doctest-modules*
+
+"""
+Adaptive segment decimation.
+
+Dense regions of tiny segments can ask for more lines per second than the link to the printer can
+deliver, starving the printer's planner. AdaptiveDecimator sits between the command source and
+Run.execute_immediate: it looks ahead at the motion time of upcoming segments and compares the line
+rate they need with the rate the printer is actually acknowledging lines at. The ack rate only says
+something about the link while lines are piling up waiting for their 'ok'; when they aren't, it
+just reflects how fast lines were being produced. While the link is behind, runs of small XY moves
+are merged as long as the merged path stays within a chordal tolerance of the original; once the
+link catches up, moves pass through untouched again.
+
+    acks = decimate.AckRate()
+    conn = Connection("COM5", 115200, on_response=acks.response)
+    script = run.Run(writer=acks.counting(conn), with_checksum=True)
+    script.execute_immediate(decimate.AdaptiveDecimator(acks.limit, tolerance=0.02)(sliced_job))
+
+Every intervention is logged.
+"""
+
+import registry
+import run
+
+import logging
+import math
+import time
+
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+
+####
+# Constants
+#
+MOVES = registry.modal_codes('position', 'move')
+""" Parameters a move may have and still be merged with its neighbours """
+MERGEABLE = frozenset('XYEF')
+ABSOLUTE, RELATIVE = registry.modes('positioning')['absolute'], registry.modes('positioning')['relative']
+ABSOLUTE_E, RELATIVE_E = registry.modes('extrusion')['absolute'], registry.modes('extrusion')['relative']
+SET_POSITION, = registry.modal_codes('position', 'set')
+HOME, = registry.modal_codes('position', 'home')
+
+
+# -----------------------------------------------------------------------------
+#
+class AckRate(object):
+    """ Measures how fast the printer is acknowledging lines, over a sliding window, and how many
+    lines are still waiting for their 'ok'. Pass 'response' as a Connection's on_response, and
+    send through counting(writer).
+
+    >>> now = [0.0]
+    >>> acks = AckRate(window=1.0, clock=lambda: now[0])
+    >>> acks.rate() is None
+    True
+    >>> for tick in range(11):
+    ...     now[0] = tick / 10
+    ...     acks.response("ok")
+    >>> acks.rate()
+    10.0
+    >>> now[0] = 5.0        # stalled
+    >>> acks.rate()
+    0.0
+
+    :param backlog: How many lines may await their 'ok' before the link counts as saturated
+    """
+    def __init__(self, window=2.0, clock=time.monotonic, backlog=4):
+        self.window = window
+        self.clock = clock
+        self.backlog = backlog
+        self.acks = deque()
+        self.seen = False
+        # Each only ever incremented from one thread (writer, reader), so no lock is needed.
+        self.lines_sent = 0
+        self.lines_acked = 0
+
+    def counting(self, writer):
+        """ Wrap a writer so the lines sent through it are counted """
+        def write(line):
+            self.lines_sent += 1
+            writer(line)
+        return write
+
+    def response(self, text):
+        if text.startswith("ok"):
+            self.acks.append(self.clock())
+            self.seen = True
+            self.lines_acked += 1
+
+    def outstanding(self):
+        """ Lines sent that haven't been acknowledged yet """
+        return self.lines_sent - self.lines_acked
+
+    def rate(self):
+        """ Lines acknowledged per second, 0 if the printer has stopped acking, None before the first ack """
+        acks, cutoff = self.acks, self.clock() - self.window
+        while acks and acks[0] < cutoff:
+            acks.popleft()
+        if len(acks) < 2:
+            return 0.0 if self.seen else None
+        return round((len(acks) - 1) / (acks[-1] - acks[0]), 6) if acks[-1] > acks[0] else None
+
+    def limit(self):
+        """ The ack rate while the link is saturated, i.e. more than 'backlog' lines are waiting to be
+        acknowledged, otherwise None: the printer is keeping up with whatever we send.
+
+        >>> acks = AckRate(backlog=2)
+        >>> write = acks.counting(lambda line: None)
+        >>> for line in range(4):
+        ...     write("G0 X1")
+        >>> acks.response("ok")
+        >>> acks.limit() is None, acks.outstanding()
+        (False, 3)
+        >>> acks.response("ok")
+        >>> acks.limit() is None, acks.outstanding()
+        (True, 2)
+        """
+        if self.outstanding() <= self.backlog:
+            return None
+        return self.rate()
+
+
+def _deviation(px, py, ax, ay, bx, by):
+    """ Distance of point p from the segment a-b """
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    if not length_sq:
+        return math.hypot(px - ax, py - ay)
+    t = min(1.0, max(0.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+# -----------------------------------------------------------------------------
+#
+class AdaptiveDecimator(object):
+    """ Merges small XY segments when the link can't keep up with them.
+
+    :param link_rate: Callable returning the lines/second the link is managing while it is saturated,
+                      or None if it is keeping up (or unknown), e.g. AckRate().limit
+    :param tolerance: Maximum distance (mm) the merged path may stray from the original points
+    :param lookahead: How many segments to consider at a time
+    :param backoff: Stop decimating once the segments need less than this fraction of the link rate
+    """
+    def __init__(self, link_rate, tolerance=0.02, lookahead=32, backoff=0.8):
+        self.link_rate = link_rate
+        self.tolerance = tolerance
+        self.lookahead = lookahead
+        self.backoff = backoff
+        self.active = False
+        self.merged = 0         # segments removed so far
+
+    def __call__(self, commands):
+        """ Generate the commands, decimated where needed. Consumes 'commands' lazily. """
+        x = y = 0.0
+        feed = None
+        relative = relative_e = False
+        pending, start = [], None   # mergeable moves awaiting a decision: (command, x, y, seconds), and where they start
+
+        for command in commands:
+            if isinstance(command, str):
+                command = run.parse_command(command)
+                if command is None:
+                    continue
+            code = getattr(command, "code", None)       # e.g. a BoundTemplate, which we just pass along
+            params = getattr(command, "parameters", {})
+
+            if code in MOVES and not relative and params.keys() <= MERGEABLE and ('X' in params or 'Y' in params):
+                move_feed = float(params['F']) if 'F' in params else feed
+                if pending and (code != pending[0][0].code or move_feed != feed):
+                    yield from self._flush(pending, start, relative_e)
+                    pending = []
+                if not pending:
+                    start = x, y
+                feed = move_feed
+                nx, ny = float(params.get('X', x)), float(params.get('Y', y))
+                seconds = math.hypot(nx - x, ny - y) / (feed / 60) if feed else 0.0
+                pending.append((command, nx, ny, seconds))
+                x, y = nx, ny
+                if len(pending) >= self.lookahead:
+                    yield from self._flush(pending, start, relative_e)
+                    pending = []
+                continue
+
+            if pending:
+                yield from self._flush(pending, start, relative_e)
+                pending = []
+
+            if code in MOVES:
+                feed = float(params['F']) if 'F' in params else feed
+                if relative:
+                    x, y = x + float(params.get('X', 0)), y + float(params.get('Y', 0))
+                else:
+                    x, y = float(params.get('X', x)), float(params.get('Y', y))
+            elif code == ABSOLUTE or code == RELATIVE:
+                relative = code == RELATIVE
+            elif code == ABSOLUTE_E or code == RELATIVE_E:
+                relative_e = code == RELATIVE_E
+            elif code == SET_POSITION:
+                x, y = float(params.get('X', x)), float(params.get('Y', y))
+            elif code == HOME:
+                homed = [axis for axis in 'XY' if axis in params] or 'XY'
+                x, y = (0.0 if 'X' in homed else x), (0.0 if 'Y' in homed else y)
+            yield command
+
+        if pending:
+            yield from self._flush(pending, start, relative_e)
+
+    def _flush(self, pending, start, relative_e):
+        """ Decide whether the link is behind, and emit the pending moves decimated or as-is """
+        seconds = sum(segment[3] for segment in pending)
+        rate = self.link_rate()
+        if rate is None or not seconds:
+            if self.active and rate is None:
+                self.active = False
+                logger.info("link caught up: no backlog; stopped decimating")
+            yield from (segment[0] for segment in pending)
+            return
+        demand = len(pending) / seconds
+
+        if not self.active and demand > rate:
+            self.active = True
+            logger.info("link behind: segments need %.0f lines/s, link is doing %.0f; decimating", demand, rate)
+        elif self.active and demand < rate * self.backoff:
+            self.active = False
+            logger.info("link caught up: segments need %.0f lines/s, link is doing %.0f; stopped decimating", demand, rate)
+        if not self.active:
+            yield from (segment[0] for segment in pending)
+            return
+
+        merged = list(self._decimate(pending, start, relative_e))
+        if len(merged) < len(pending):
+            self.merged += len(pending) - len(merged)
+            logger.info("merged %d segments into %d (need %.0f lines/s, link %.0f, tolerance %gmm)",
+                        len(pending), len(merged), demand, rate, self.tolerance)
+        yield from merged
+
+    def _decimate(self, pending, start, relative_e):
+        """ Greedily merge consecutive segments while every point skipped stays within tolerance
+        of the merged segment. """
+        tolerance = self.tolerance
+        points = [start] + [(segment[1], segment[2]) for segment in pending]
+        first = 0
+        while first < len(pending):
+            (ax, ay), end = points[first], first + 1
+            while end < len(pending):
+                bx, by = points[end + 1]
+                if any(_deviation(*points[k], ax, ay, bx, by) > tolerance for k in range(first + 1, end + 1)):
+                    break
+                end += 1
+            yield self._merge(pending[first:end], relative_e)
+            first = end
+
+    @staticmethod
+    def _merge(segments, relative_e):
+        """ One move that goes to the last segment's end, extruding what they all did """
+        if len(segments) == 1:
+            return segments[0][0]
+        first, last = segments[0][0], segments[-1][0]
+        merged = last.copy()
+        merged.parameters = {}
+        for axis, value in (('X', segments[-1][1]), ('Y', segments[-1][2])):
+            if any(axis in command.parameters for command, *_ in segments):
+                merged.parameters[axis] = last.parameters.get(axis, value)
+        extrusions = [command.parameters['E'] for command, *_ in segments if 'E' in command.parameters]
+        if extrusions:
+            merged.parameters['E'] = round(sum(float(e) for e in extrusions), 5) if relative_e else extrusions[-1]
+        if 'F' in first.parameters:
+            merged.parameters['F'] = first.parameters['F']
+        return merged
@@ -4,24 +4,30 @@ common multi-stage operations.
 
 Each helper generates an instance of the codes.Code() class, which holds the translated
 parameter list for the code and is responsible for tracking the line no when the command
-is executed.
+is executed. The codes, their parameters and which helper makes them are described in
+registry.SPECS, which also provides the constructors the helpers use.
 
 Use run.Run() to build/generate/execute sequences. Direct-execution of gcode can be
 implemented by providing a Writer() class that talks directly to a device.
 """
 
+import registry
+
 from codes import Code
+from registry import BUILDERS as build
 
 
 ####
 # Constants
 #
 """ Extrusion modes that map to M commands: 'absolute' and 'relative' """
-EXTRUSION_MODES = { 'absolute': "M82", 'relative': "M83"}
+EXTRUSION_MODES = registry.modes('extrusion')
 """ Names of units that map to G commands: 'mm'/'millimeter', 'in'/'inches' """
-UNITS = { 'mm': "G20", 'millimeter': "G20", 'millimeters': "G20", 'in': "G21", 'inch': "G21", 'inches': "G21" }
+UNITS = {name: registry.modes('units')[unit] for unit, names in (('mm', ('mm', 'millimeter', 'millimeters')),
+                                                                   ('in', ('in', 'inch', 'inches')))
+         for name in names}
 """ Position modes that map to G commands: 'absolute' and 'relative' """
-POSITIONING_MODES = { 'absolute': "G90", 'relative': "G91" }
+POSITIONING_MODES = registry.modes('positioning')
 
 
 ####
@@ -59,7 +65,7 @@ def set_lineno(number):
     """
     if number < 1:
         raise ValueError("Cannot set line number < 0")
-    item = Code("M110", n=number, comment="set line no")
+    item = build.M110(N=number, comment="set line no")
     # Because I'm setting the line number, I behave as though I come from
     # the line before this one.
     item.line_no = number - 1
@@ -68,73 +74,71 @@ def set_lineno(number):
 def set_hotendtemp(celcius, toolidx=None, max_auto=None):
     """ M104: Set temp of a hot end and/or the max autotemp for it """
     b, f = (max_auto, '') if max_auto is not None else (None, None)
-    return Code('M104', s=celcius, t=toolidx, b=b, f=f,
-                comment="set hotend temp")
+    return build.M104(S=celcius, T=toolidx, B=b, F=f,
+                      comment="set hotend temp")
 
 def get_temp(toolidx=None):
     """ M105: Request a temperatures report """
-    return Code('M105', t=toolidx,
-                comment="report bed temp")
+    return build.M105(T=toolidx,
+                      comment="report bed temp")
 
 def wait_hotendtemp(celcius, toolidx=None, heat_to=False, max_auto=None):
     """ M109: Wait for hotend to reach a temperature """
     b, f = (max_auto, '') if max_auto is not None else (None, None)
     s, r = (celcius, None) if not heat_to else (None, celcius)
-    return Code('M109', s=s, r=r, b=b, f=f, t=toolidx, comment="wait on hotend temp")
+    return build.M109(S=s, R=r, B=b, F=f, T=toolidx, comment="wait on hotend temp")
 
 def wait_bedtemp(celcius, heat_to=False):
     """ M190: Wait for the bed to heat/cool to a temp, or to to heat past a temp """
     s, r = (celcius, None) if not heat_to else (None, celcius)
-    return Code('M190', s=s, r=r,
-                comment="wait for bedtemp to heat")
+    return build.M190(S=s, R=r,
+                      comment="wait for bedtemp to heat")
 
 def set_bedtemp(celcius):
     """ M140: Set the bed temperature """
-    return Code('M140', comment="set bed temp")
+    return build.M140(S=celcius, comment="set bed temp")
 
 def set_extrudemode(ext_mode):
     """ M82/M83: Set extrusion mode to absolute/relative """
-    return Code(EXTRUSION_MODES[ext_mode], comment=f"set {ext_mode} e-mode")
+    return getattr(build, EXTRUSION_MODES[ext_mode])(comment=f"set {ext_mode} e-mode")
 
 def set_units(unit):
-    """ G20/G21: Switch units: mm/millimeter or in/inches """
-    return Code(UNITS[unit], comment=f"Set units to {unit}")
+    """ G21/G20: Switch units: mm/millimeter or in/inches """
+    return getattr(build, UNITS[unit])(comment=f"Set units to {unit}")
 
 def set_positioning(pos_mode):
     """ G90/G91: Change positioning mode to absolute/relative """
-    return Code(POSITIONING_MODES[pos_mode], comment=f"set pos_mode positioning mode")
+    return getattr(build, POSITIONING_MODES[pos_mode])(comment=f"set pos_mode positioning mode")
 
 def set_fanspeed(speed, fanidx=None, secondary=None):
     """ M106: Set the fan speed (-1 for off, 0-255)"""
-    return Code("M106", p=fanidx, s=speed, t=secondary)
+    return build.M106(P=fanidx, S=speed, T=secondary)
 
 def set_fanoff(fanidx=None):
     """ M107: Turn off a fan """
-    return Code("M107", p=fanidx)
+    return build.M107(P=fanidx)
 
 def home_axis(x=None, y=None, z=None, optional=None):
     """ G28: Home one or more axis. """
-    return Code("G28", x=Bool(x), y=Bool(y), z=Bool(z), o=Bool(optional))
+    return build.G28(X=Bool(x), Y=Bool(y), Z=Bool(z), O=Bool(optional))
 
 def set_axisstepsperunit(steps=None, extruderidx=None, x_units=None, y_units=None, z_units=None):
     """ G92: Set the steps-per-unit for one or more axis """
-    return Code("G92", e=steps, t=extruderidx, x=x_units, y=y_units, z=z_units)
+    return build.G92(E=steps, T=extruderidx, X=x_units, Y=y_units, Z=z_units)
 
 def move(x=None, y=None, z=None, feed_rate=None, filament=None, extruding=False):
     """ G0/G1: Move the active print head """
-    if not( x or y or z or feed_rate or filament):
+    if x is None and y is None and z is None and feed_rate is None and filament is None:
         raise ValueError("move requires at least one argument")
     extruding = extruding or bool(filament)
     if feed_rate: feed_rate *= 60
-    return Code("G0" if not extruding else "G1",
-                x=x, y=y, z=z, f=feed_rate, e=filament,
-                )
+    return (build.G1 if extruding else build.G0)(X=x, Y=y, Z=z, F=feed_rate, E=filament)
 
 def get_position(detail=None):
     """ M114: Query the current position """
     if detail is not None:
         detail = "<" if not detail else ">"
-    return Code("M114", d=detail, comment="get position")
+    return build.M114(D=detail, comment="get position")
 
 ####
 # General helpers.
@@ -149,4 +153,4 @@ def home_all_axis():
 
 def extrude(x=None, y=None, z=None, feed_rate=None, filament=None):
     """ Abbreviation for calling move() with extruding=True """
-    return move(x=x, y=y, z=z, feed_rate=feed_rate, filamen=filament, extruding=True)
+    return move(x=x, y=y, z=z, feed_rate=feed_rate, filament=filament, extruding=True)
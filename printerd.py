@@ -0,0 +1,443 @@
+#! /usr/bin/env python3
+
+"""
+Shared printer daemon.
+
+Opening a Connection resets many boards and takes the port for itself, so only one script can talk
+to a printer at a time and every reconnect costs seconds. printerd owns the Connection for as long
+as it runs, and lets any number of local clients share it over a Unix socket:
+
+    > python printerd.py --socket /tmp/printer.sock COM5
+
+    import ops, printerd
+    with printerd.PrinterClient("/tmp/printer.sock", on_response=print) as printer:
+        printer.subscribe()
+        printer.submit([ops.home_axis(), ops.get_temp()])
+        printer.sync()
+
+Line numbers and checksums are assigned centrally by the daemon's Run; clients send plain lines (any
+line number, checksum or comment is stripped) and any M110 they send is dropped. Each submitted
+batch reaches the printer contiguously. Lines are checked as they arrive, and a batch with a line
+the daemon can't parse, or that doesn't match what the code takes, is rejected as a whole.
+
+The protocol is line based text. Anything not starting with '!' is a line of gcode added to the
+client's pending batch; control lines are:
+    !go             submit the pending batch, replies "ok <count>"
+    !sync           wait until everything submitted so far has been written, replies "ok"
+    !subscribe      have printer responses forwarded as "< <response>" lines
+    !unsubscribe    stop forwarding responses, replies "ok"
+    !ping           replies "pong"
+Failures are reported as "error <message>". If writing to the printer fails, every client with
+lines submitted since its last "!sync" gets an error in reply to its next "!go" or "!sync", which
+then queues nothing. A subscriber that falls too far behind reading responses is disconnected.
+"""
+
+import ops
+import recorder
+import registry
+import run
+
+import argparse
+import errno
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from template import BoundTemplate
+
+
+####
+# Constants
+#
+""" Default location of the daemon's socket """
+DEFAULT_SOCKET = "/tmp/pymcode.sock"
+""" Prefix of forwarded printer responses """
+RESPONSE = "< "
+""" How many responses may wait for a subscriber before it is considered stuck and disconnected """
+RESPONSE_BACKLOG = 1000
+
+
+# -----------------------------------------------------------------------------
+#
+class ClientHandler(socketserver.StreamRequestHandler):
+    """ Services one client connection for the daemon. """
+    def setup(self):
+        super().setup()
+        self.batch = []
+        self.batch_error = None
+        self.send_lock = threading.Lock()
+        self.outstanding = False    # submitted lines since the last sync
+        self.link_error = None      # set by the daemon if writing to the printer failed since then
+        self.responses = None       # printer responses waiting to be forwarded, while subscribed
+        self.forwarder = None
+        self.server.connected(self)
+
+    def send(self, text):
+        """ Send a line to the client; responses are forwarded from the reader thread, hence the lock. """
+        with self.send_lock:
+            self.wfile.write((text + "\n").encode())
+            self.wfile.flush()
+
+    def handle(self):
+        daemon = self.server
+        for raw in self.rfile:
+            line = raw.decode(errors='replace').strip()
+            if not line:
+                continue
+            if not line.startswith('!'):
+                self.add(line)
+                continue
+            try:
+                if line == "!go":
+                    batch, error, self.batch, self.batch_error = self.batch, self.batch_error, [], None
+                    link_error = self.take_link_error()
+                    if error or link_error:
+                        self.send(f"error {error or link_error}")
+                    else:
+                        self.outstanding = True
+                        self.send(f"ok {daemon.submit(batch)}")
+                elif line == "!sync":
+                    daemon.sync()
+                    link_error = self.take_link_error()
+                    self.outstanding = False
+                    self.send(f"error {link_error}" if link_error else "ok")
+                elif line == "!subscribe":
+                    daemon.subscribe(self)
+                    self.send("ok")
+                elif line == "!unsubscribe":
+                    forwarder = daemon.unsubscribe(self)
+                    if forwarder:
+                        forwarder.join()    # everything forwarded so far arrives before the reply
+                    self.send("ok")
+                elif line == "!ping":
+                    self.send("pong")
+                else:
+                    self.send(f"error unknown command {line}")
+            except Exception as e:
+                logging.warning("client request %s failed: %s", line, e)
+                self.send(f"error {e}")
+
+    def add(self, line):
+        """ Check a line of gcode and add it to the pending batch. Errors are kept for the '!go', so
+        a bad line can't reach the printer, or the sender thread everyone shares. """
+        line = recorder.strip_line(line)
+        if not line or self.batch_error:
+            return
+        try:
+            command = run.parse_command(line)
+            if registry.spec_for(command.code) or registry.TOOL_CODE.match(command.code):
+                registry.validate(command)
+        except ValueError as e:
+            self.batch_error = f"rejected '{line}': {e}"
+            logging.warning("client line %s", self.batch_error)
+            return
+        self.batch.append(line)
+
+    def take_link_error(self):
+        """ The printer link failure this client hasn't been told about yet, if any """
+        error, self.link_error = self.link_error, None
+        return f"printer link failed, lines since the last sync may not have been sent: {error}" if error else None
+
+    def start_forwarding(self, backlog):
+        """ Forward printer responses, through a queue and a thread of our own so a client that is
+        slow to read only holds up itself. """
+        if self.responses is None:
+            self.responses = queue.Queue(backlog)
+            self.forwarder = threading.Thread(target=self._forward, args=(self.responses,), daemon=True)
+            self.forwarder.start()
+
+    def stop_forwarding(self):
+        """ Stop forwarding once what is already queued has been sent, returning the forwarder thread """
+        responses, self.responses = self.responses, None
+        if responses is not None:
+            try:
+                responses.put_nowait(None)
+            except queue.Full:
+                pass        # it's stuck on a client that isn't reading, and gets disconnected
+        return self.forwarder
+
+    def _forward(self, responses):
+        for text in iter(responses.get, None):
+            try:
+                self.send(RESPONSE + text)
+            except OSError:
+                return
+
+    def forward(self, text):
+        """ Queue a printer response for the client, returning False if it has fallen too far behind """
+        responses = self.responses
+        if responses is not None:
+            try:
+                responses.put_nowait(text)
+            except queue.Full:
+                return False
+        return True
+
+    def disconnect(self):
+        """ Drop the client, e.g. one that has stopped reading; also unblocks a forwarder stuck writing to it """
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def finish(self):
+        self.server.unsubscribe(self)
+        self.server.disconnected(self)
+        super().finish()
+
+
+# -----------------------------------------------------------------------------
+#
+class PrinterDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Owns the writer (normally a Connection) and multiplexes clients onto it.
+
+    Give 'response' to the Connection as its on_response so printer output reaches subscribers.
+
+    :param path: Where to create the Unix socket; a stale socket file is replaced, a live one is an error
+    :param writer: The Writer that talks to the printer
+    :param with_checksum: Number and checksum lines sent to the printer
+    :param keepalive: If set, send an M105 after this many idle seconds to keep the link warm
+    :param response_backlog: Responses that may wait for a subscriber before it is disconnected
+    """
+    daemon_threads = True
+
+    def __init__(self, path, writer, with_checksum=True, keepalive=None, response_backlog=RESPONSE_BACKLOG):
+        if os.path.exists(path):
+            self._remove_stale(path)
+        self.writer = writer
+        self.keepalive = keepalive
+        self.response_backlog = response_backlog
+        self.last_activity = time.monotonic()
+        self.clients = set()
+        self.subscribers = set()
+        self.subscriber_lock = threading.Lock()
+        super().__init__(path, ClientHandler)
+        self.path = path
+        # The daemon runs for as long as the printer is on, so don't keep every line ever sent.
+        self.script = run.BackgroundRun(with_checksum=with_checksum, without_comments=True, writer=self._write, keep_history=False)
+
+    @staticmethod
+    def _remove_stale(path):
+        """ Remove a socket left behind by a daemon that died, but not one that is still being served. """
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+        finally:
+            probe.close()
+        raise OSError(errno.EADDRINUSE, f"A printer daemon is already serving {path}")
+
+    def _write(self, line):
+        """ The script's writer. A failure is reported to the clients whose lines may be lost rather
+        than raised, which would make the shared Run drop later batches from everyone, and report
+        the error to whoever happened to ask next. """
+        try:
+            self.writer(line)
+        except Exception as e:
+            logging.warning("writing %s to the printer failed: %s", line, e)
+            with self.subscriber_lock:
+                clients = [client for client in self.clients if client.outstanding]
+            for client in clients:
+                client.link_error = e
+
+    def connected(self, client):
+        with self.subscriber_lock:
+            self.clients.add(client)
+
+    def disconnected(self, client):
+        with self.subscriber_lock:
+            self.clients.discard(client)
+
+    def submit(self, lines):
+        """ Queue a batch of lines for the printer, returning how many were accepted. """
+        # Line numbering belongs to the daemon, a client's M110 would derail it.
+        batch = [line for line in lines if line.split(None, 1)[0] != "M110"]
+        self.script.execute_immediate(batch)
+        self.last_activity = time.monotonic()
+        return len(batch)
+
+    def sync(self):
+        """ Wait for everything queued so far to have been written. """
+        self.script.join()
+
+    def subscribe(self, client):
+        client.start_forwarding(self.response_backlog)
+        with self.subscriber_lock:
+            self.subscribers.add(client)
+
+    def unsubscribe(self, client):
+        """ Stop forwarding responses to client, returning its forwarder thread """
+        with self.subscriber_lock:
+            self.subscribers.discard(client)
+        return client.stop_forwarding()
+
+    def response(self, text):
+        """ Forward a printer response to every subscriber. This is called on the Connection's
+        reader thread, so it only queues: a subscriber that has stopped reading is disconnected. """
+        with self.subscriber_lock:
+            subscribers = list(self.subscribers)
+        for client in subscribers:
+            if not client.forward(text):
+                logging.warning("subscriber fell %d responses behind, disconnecting it", self.response_backlog)
+                self.unsubscribe(client)
+                client.disconnect()
+
+    def service_actions(self):
+        """ Called by serve_forever between requests: keep the link warm when idle. """
+        if self.keepalive and time.monotonic() - self.last_activity >= self.keepalive:
+            self.last_activity = time.monotonic()
+            try:
+                self.script.execute_immediate(ops.get_temp())
+            except Exception as e:
+                # A sender error must not escape serve_forever and take the daemon down with it.
+                logging.warning("keepalive failed: %s", e)
+
+    def server_close(self):
+        super().server_close()
+        self.script.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+# -----------------------------------------------------------------------------
+#
+class PrinterClient(run.Writer):
+    """ Client for a PrinterDaemon. Also works as a Writer, sending each line as its own batch.
+
+    :param path: The daemon's socket
+    :param on_response: Called with each printer response once subscribed
+    :param timeout: Seconds to wait for the daemon to reply to a request. If it doesn't, the
+                    connection is closed, as its reply would otherwise answer the next request.
+    """
+    def __init__(self, path=DEFAULT_SOCKET, on_response=None, timeout=30):
+        self.on_response = on_response
+        self.timeout = timeout
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.wfile = self.sock.makefile("wb")
+        self.replies = queue.Queue()
+        self.request_lock = threading.Lock()
+        self.reader = threading.Thread(target=self._reader, args=(self.sock.makefile("rb"),), daemon=True)
+        self.reader.start()
+
+    def _reader(self, rfile):
+        """ Route forwarded responses to on_response and everything else to whoever is waiting on a reply. """
+        for raw in rfile:
+            line = raw.decode(errors='replace').rstrip("\n")
+            if line.startswith(RESPONSE):
+                if self.on_response:
+                    self.on_response(line[len(RESPONSE):])
+            else:
+                self.replies.put(line)
+        self.replies.put(None)
+
+    def request(self, lines, timeout=None):
+        """ Send lines, the last being a control line, and return the daemon's reply.
+
+        :param timeout: Seconds to wait for the reply, instead of the client's timeout
+        """
+        with self.request_lock:
+            if self.sock.fileno() < 0:
+                raise ConnectionError("printer daemon connection is closed")
+            self.wfile.write("".join(line + "\n" for line in lines).encode())
+            self.wfile.flush()
+            try:
+                reply = self.replies.get(timeout=self.timeout if timeout is None else timeout)
+            except queue.Empty:
+                self.close()
+                raise TimeoutError("printer daemon did not reply, connection closed")
+        if reply is None:
+            raise ConnectionError("printer daemon closed the connection")
+        if reply.startswith("error"):
+            raise RuntimeError(reply[6:])
+        return reply
+
+    def submit(self, commands):
+        """ Send commands (anything Run accepts) as a single batch, returning how many lines were queued. """
+        if isinstance(commands, run.SINGLE_COMMANDS):
+            commands = (commands,)
+        lines = []
+        for command in commands:
+            if isinstance(command, str):
+                # Lines numbered/checksummed by a Run using us as its writer are renumbered by the daemon.
+                lines.append(recorder.strip_line(command))
+            elif isinstance(command, BoundTemplate):
+                lines.extend(command.render(without_comments=True)[0])
+            else:
+                lines.append(command.emit(without_comments=True))
+        lines.append("!go")
+        return int(self.request(lines).split()[1])
+
+    def sync(self, timeout=None):
+        """ Wait for the daemon to have written everything submitted so far.
+
+        :param timeout: Seconds to wait, instead of the client's timeout; a long queue can take a while
+        """
+        self.request(["!sync"], timeout)
+
+    def subscribe(self, on_response=None):
+        """ Start receiving printer responses """
+        if on_response:
+            self.on_response = on_response
+        self.request(["!subscribe"])
+
+    def unsubscribe(self):
+        self.request(["!unsubscribe"])
+
+    def ping(self):
+        return self.request(["!ping"]) == "pong"
+
+    def __call__(self, line):
+        self.submit(line)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)    # the files from makefile() would keep it open otherwise
+        except OSError:
+            pass
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main(arglist):
+    from connection import Connection
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", "-s",   type=str, help=f"Socket path [default: {DEFAULT_SOCKET}]", default=DEFAULT_SOCKET)
+    parser.add_argument("--baud", "-b",     type=int, help="Baud rate [default: 115200]", default=115200)
+    parser.add_argument("--keepalive", "-k", type=float, help="Seconds idle before sending an M105 [default: 10]", default=10.0)
+    parser.add_argument("--no-checksum",    action="store_true", help="Don't number/checksum lines")
+    parser.add_argument("--verbose", "-v",  action="count", help="Increased verbosity", default=0)
+    parser.add_argument("comport",          type=str, help="Serial port of the printer")
+
+    args = parser.parse_args(arglist)
+
+    log_levels = [logging.WARN, logging.INFO, logging.DEBUG]
+    logging.basicConfig(level=log_levels[min(args.verbose, len(log_levels)-1)])
+
+    with Connection(args.comport, args.baud) as conn:
+        server = PrinterDaemon(args.socket, conn, with_checksum=not args.no_checksum, keepalive=args.keepalive)
+        conn.on_response = server.response
+        logging.info("serving %s on %s", args.comport, args.socket)
+        try:
+            server.serve_forever(poll_interval=0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
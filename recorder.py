@@ -0,0 +1,262 @@
+#! *python3:doctest-modules*
+
+"""
+Session recording and replay.
+
+A Recorder logs the lines a Run sends and the responses that come back to a compact binary
+trace with nanosecond timestamps. RecordingWriter taps the writer side of a Run, and the
+Recorder's 'received' method can be handed to Connection(on_response=...) to tap the reader.
+
+A recorded trace can be replayed through a Run and writer stack at the original or an
+accelerated speed to compare the latency distribution of a change against the original.
+
+    > python recorder.py stats session.trace
+    > python recorder.py replay session.trace --speed 10 --ack-delay 0.002
+"""
+
+import run
+
+import argparse
+import io
+import math
+import re
+import struct
+import sys
+import threading
+import time
+
+from collections import namedtuple
+
+
+####
+# Constants
+#
+""" Identifies a trace file (and the format version) """
+TRACE_MAGIC = b"MCTRACE1"
+""" Record header: event kind, nanoseconds since the start of the recording, payload length """
+RECORD = struct.Struct("<cQI")
+""" Event kinds """
+SENT, RECEIVED = b'S', b'R'
+
+
+""" A single recorded event """
+TraceEvent = namedtuple("TraceEvent", ("kind", "ns", "text"))
+
+""" Summary of a latency distribution, in milliseconds """
+LatencyStats = namedtuple("LatencyStats", ("count", "min", "mean", "p50", "p90", "p99", "max"))
+
+
+# -----------------------------------------------------------------------------
+#
+class Recorder(object):
+    """ Writes sent/received events to a binary stream with nanosecond timestamps.
+
+    >>> import io
+    >>> stream = io.BytesIO()
+    >>> with Recorder(stream) as rec:
+    ...     rec.sent("G28")
+    ...     rec.received("ok")
+    >>> [(e.kind, e.text) for e in read_trace(io.BytesIO(stream.getvalue()))]
+    [(b'S', 'G28'), (b'R', 'ok')]
+    """
+    def __init__(self, stream, clock=time.perf_counter_ns):
+        self.stream = stream
+        self.clock = clock
+        self.lock = threading.Lock()    # sends and responses arrive on different threads
+        self.stream.write(TRACE_MAGIC)
+        self.start = clock()
+
+    def record(self, kind, text):
+        """ Append an event to the trace, timestamped now """
+        data = text.encode()
+        with self.lock:
+            # Read the clock under the lock too, so timestamps in the trace never go backwards.
+            ns = self.clock() - self.start
+            self.stream.write(RECORD.pack(kind, ns, len(data)))
+            self.stream.write(data)
+
+    def sent(self, line):
+        """ Record a line sent to the device """
+        self.record(SENT, line)
+
+    def received(self, text):
+        """ Record a response from the device; suitable for Connection(on_response=...) """
+        self.record(RECEIVED, text)
+
+    def close(self):
+        with self.lock:
+            self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# -----------------------------------------------------------------------------
+#
+class RecordingWriter(run.Writer):
+    """ Writer tap that records each line before forwarding it to the real writer.
+
+    >>> import io
+    >>> sent = []
+    >>> w = RecordingWriter(sent.append, Recorder(io.BytesIO()))
+    >>> w("M105")
+    >>> sent
+    ['M105']
+    """
+    def __init__(self, writer, recorder):
+        self.writer = writer
+        self.recorder = recorder
+
+    def __call__(self, line):
+        self.recorder.sent(line)
+        self.writer(line)
+
+
+# -----------------------------------------------------------------------------
+#
+class FakeDevice(run.Writer):
+    """ Stand-in for a printer that acknowledges every line with 'ok' after a fixed delay.
+
+    >>> responses = []
+    >>> FakeDevice(responses.append)("G28")
+    >>> responses
+    ['ok']
+    """
+    def __init__(self, on_response, ack_delay=0.0):
+        self.on_response = on_response
+        self.ack_delay = ack_delay
+
+    def __call__(self, line):
+        if self.ack_delay:
+            time.sleep(self.ack_delay)
+        self.on_response("ok")
+
+
+####
+# Trace helpers
+#
+def read_trace(stream):
+    """ Generate the TraceEvents from a binary trace stream """
+    if stream.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+        raise ValueError("Not a trace file (or unsupported version)")
+    read, size = stream.read, RECORD.size
+    while True:
+        header = read(size)
+        if len(header) < size:
+            return
+        kind, ns, length = RECORD.unpack(header)
+        yield TraceEvent(kind, ns, read(length).decode())
+
+
+def strip_line(text):
+    """ Remove the line number, checksum and comment from an emitted line, so it can be re-run.
+
+    >>> strip_line("N12 G0 X1 Y2*41 ;move")
+    'G0 X1 Y2'
+    >>> strip_line("M105")
+    'M105'
+    """
+    text = text.partition(';')[0]
+    text = re.sub(r'^N\d+\s+', '', text.strip())
+    return re.sub(r'\*\d+$', '', text)
+
+
+def latencies(events):
+    """ Pair each sent line with the 'ok' that acknowledges it, yielding the delay in ns.
+    Acknowledgements arrive in the order lines were sent, so this is a simple fifo.
+
+    >>> list(latencies([TraceEvent(SENT, 10, "G28"), TraceEvent(SENT, 15, "M105"),
+    ...                 TraceEvent(RECEIVED, 30, "ok"), TraceEvent(RECEIVED, 31, "echo:busy"),
+    ...                 TraceEvent(RECEIVED, 40, "ok T:20.0")]))
+    [20, 25]
+    """
+    pending, waiting = [], 0
+    for event in events:
+        if event.kind == SENT:
+            pending.append(event.ns)
+        elif event.text.startswith("ok") and waiting < len(pending):
+            yield event.ns - pending[waiting]
+            waiting += 1
+
+
+def summarize(delays):
+    """ Reduce a sequence of nanosecond delays to LatencyStats in milliseconds, nearest-rank percentiles.
+
+    >>> summarize([1000000, 2000000, 3000000, 4000000])
+    LatencyStats(count=4, min=1.0, mean=2.5, p50=2.0, p90=4.0, p99=4.0, max=4.0)
+    """
+    delays = sorted(delays)
+    if not delays:
+        return LatencyStats(0, *([0.0] * 6))
+    count = len(delays)
+    ms = lambda ns: ns / 1e6
+    pct = lambda p: ms(delays[max(0, math.ceil(count * p) - 1)])
+    return LatencyStats(count, ms(delays[0]), ms(sum(delays) / count),
+                        pct(0.5), pct(0.9), pct(0.99), ms(delays[-1]))
+
+
+def replay(events, writer, speed=1.0, with_checksum=None):
+    """ Drive the sent lines of a trace back through a Run into 'writer'. Each line is replayed as
+    recorded, only its line number and checksum are redone by the Run.
+
+    :param events: TraceEvents, e.g. from read_trace()
+    :param writer: The writer stack to send to, e.g. RecordingWriter(FakeDevice(...), ...)
+    :param speed: Playback speed relative to the recording (2 = twice as fast); 0 for no delays
+    :param with_checksum: Emit checksums; by default, whatever the recording did
+    :returns: The Run, so callers can inspect its history
+    """
+    sends = [event for event in events if event.kind == SENT]
+    if with_checksum is None:
+        with_checksum = any('*' in event.text for event in sends)
+    script = run.Run(with_checksum=with_checksum, without_comments=True, writer=writer)
+    if not sends:
+        return script
+
+    first, start = sends[0].ns, time.perf_counter_ns()
+    for event in sends:
+        if speed:
+            delay = start + (event.ns - first) / speed - time.perf_counter_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+        script.execute_immediate(strip_line(event.text))
+    return script
+
+
+def print_stats(label, stats):
+    print(f"{label}: {stats.count} acks, min {stats.min:.3f}ms, mean {stats.mean:.3f}ms, "
+          f"p50 {stats.p50:.3f}ms, p90 {stats.p90:.3f}ms, p99 {stats.p99:.3f}ms, max {stats.max:.3f}ms")
+
+
+def main(arglist):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action",           choices=("stats", "replay"), help="Summarize or replay a trace")
+    parser.add_argument("trace",            type=str, help="Trace file to read")
+    parser.add_argument("--speed",          type=float, help="Replay speed multiplier, 0 for flat out [default: 1]", default=1.0)
+    parser.add_argument("--ack-delay",      type=float, help="Seconds the fake device takes to ack a line [default: 0]", default=0.0)
+    parser.add_argument("--output", "-o",   type=str, help="Record the replay to this trace file", default=None)
+
+    args = parser.parse_args(arglist)
+
+    with open(args.trace, "rb") as stream:
+        events = list(read_trace(stream))
+    print_stats("recorded", summarize(latencies(events)))
+    if args.action != "replay":
+        return
+
+    output = io.BytesIO()
+    with Recorder(output) as recorder:
+        device = FakeDevice(recorder.received, ack_delay=args.ack_delay)
+        replay(events, RecordingWriter(device, recorder), speed=args.speed)
+    if args.output:
+        with open(args.output, "wb") as stream:
+            stream.write(output.getvalue())
+    output.seek(0)
+    replayed = list(read_trace(output))
+    print_stats("replayed", summarize(latencies(replayed)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
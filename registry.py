@@ -0,0 +1,311 @@
+#! *python3:doctest-modules*
+
+"""
+Table of the g/m codes this package knows about.
+
+Each Spec describes a code: the ops helper that produces it, its parameters (letter, type and the
+helper argument they come from) and its modal effects. Everything that needs to know about a code
+works from this one table:
+
+  - BUILDERS has a specialized constructor per code, generated from the table the first time the
+    code is used, which builds a Code without the kwargs filtering/uppercasing of Code.__init__,
+  - parse() turns text back into a Code,
+  - validate() checks a Code's parameters against its Spec,
+  - to_helper() maps a Code (or text) back to the ops helper and arguments that produce it,
+  - modes() and modal_codes() give the codes that set each mode, for ops and the stream
+    transforms (transform, decimate) to work from,
+  - the ultimaker3 repl looks helpers up and converts their arguments here.
+
+>>> BUILDERS.M104(S=200, comment="set hotend temp")
+<Code(code=M104, comment="set hotend temp", S=200)>
+>>> to_helper("G1 X10 Y5 F3000 E0.4")
+('move', {'extruding': True, 'x': 10, 'y': 5, 'feed_rate': 50, 'filament': 0.4})
+"""
+
+import re
+
+from collections import namedtuple
+
+from codes import Code
+
+
+####
+# Parameter types: convert the text (or value) of a parameter to what the helper takes,
+# raising ValueError if it isn't valid.
+#
+def number(value):
+    """ An int if it is a whole number as written, otherwise a float
+
+    >>> number("200"), number("0.5"), number(3)
+    (200, 0.5, 3)
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def flag(value):
+    """ A parameter that is present without a value, e.g. the X in 'G28 X' """
+    if value not in ('', True):
+        raise ValueError("flags don't take a value")
+    return True
+
+
+def detail(value):
+    """ M114's D parameter: '>' for detail, '<' for none """
+    if value not in ('<', '>'):
+        raise ValueError("expected '<' or '>'")
+    return value == '>'
+
+
+""" A parameter: its letter, type, the helper argument it maps to (None if it is derived from
+    other arguments), a divisor to undo any scaling the helper does, and other helper arguments
+    its presence implies. """
+Field = namedtuple("Field", ("letter", "type", "arg", "scale", "implies"))
+Field.__new__.__defaults__ = (None, 1, None)
+
+""" A code: the helper that makes it, its Fields (in the order the helper passes them), helper
+    arguments implied by the code itself, and the modal state it changes. """
+Spec = namedtuple("Spec", ("code", "helper", "fields", "fixed", "modal"))
+Spec.__new__.__defaults__ = ((), None, None)
+
+
+####
+# The table
+#
+SPECS = (
+    Spec("M110", "set_lineno", (Field('N', int, 'number'),)),
+    Spec("M104", "set_hotendtemp", (Field('S', number, 'celcius'), Field('T', int, 'toolidx'),
+                                    Field('B', number, 'max_auto'), Field('F', flag))),
+    Spec("M105", "get_temp", (Field('T', int, 'toolidx'),)),
+    Spec("M109", "wait_hotendtemp", (Field('S', number, 'celcius'), Field('R', number, 'celcius', implies={'heat_to': True}),
+                                     Field('B', number, 'max_auto'), Field('F', flag), Field('T', int, 'toolidx'))),
+    Spec("M190", "wait_bedtemp", (Field('S', number, 'celcius'), Field('R', number, 'celcius', implies={'heat_to': True}))),
+    Spec("M140", "set_bedtemp", (Field('S', number, 'celcius'),)),
+    Spec("M82", "set_extrudemode", fixed={'ext_mode': 'absolute'}, modal={'extrusion': 'absolute'}),
+    Spec("M83", "set_extrudemode", fixed={'ext_mode': 'relative'}, modal={'extrusion': 'relative'}),
+    Spec("G20", "set_units", fixed={'unit': 'in'}, modal={'units': 'in'}),
+    Spec("G21", "set_units", fixed={'unit': 'mm'}, modal={'units': 'mm'}),
+    Spec("G90", "set_positioning", fixed={'pos_mode': 'absolute'}, modal={'positioning': 'absolute'}),
+    Spec("G91", "set_positioning", fixed={'pos_mode': 'relative'}, modal={'positioning': 'relative'}),
+    Spec("M106", "set_fanspeed", (Field('P', int, 'fanidx'), Field('S', int, 'speed'), Field('T', int, 'secondary'))),
+    Spec("M107", "set_fanoff", (Field('P', int, 'fanidx'),)),
+    Spec("G28", "home_axis", (Field('X', flag, 'x'), Field('Y', flag, 'y'), Field('Z', flag, 'z'), Field('O', flag, 'optional')),
+         modal={'position': 'home'}),
+    Spec("G92", "set_axisstepsperunit", (Field('E', number, 'steps'), Field('T', int, 'extruderidx'),
+                                         Field('X', number, 'x_units'), Field('Y', number, 'y_units'), Field('Z', number, 'z_units')),
+         modal={'position': 'set'}),
+    Spec("G0", "move", (Field('X', number, 'x'), Field('Y', number, 'y'), Field('Z', number, 'z'),
+                        Field('F', number, 'feed_rate', scale=60), Field('E', number, 'filament')),
+         fixed={'extruding': False}, modal={'position': 'move'}),
+    Spec("G1", "move", (Field('X', number, 'x'), Field('Y', number, 'y'), Field('Z', number, 'z'),
+                        Field('F', number, 'feed_rate', scale=60), Field('E', number, 'filament')),
+         fixed={'extruding': True}, modal={'position': 'move'}),
+    Spec("M114", "get_position", (Field('D', detail, 'detail'),)),
+)
+SPECS_BY_CODE = {spec.code: spec for spec in SPECS}
+
+""" Tool selection carries its argument in the code itself, e.g. T1 """
+TOOL_CODE = re.compile(r"T(\d+)$")
+TOOL_HELPER = "set_toolidx"
+
+""" ops helpers that are built on the ones above rather than mapping to a code of their own """
+COMPOSITES = ("zero_extruded_length", "home_all_axis", "extrude")
+
+
+####
+# Generated constructors
+#
+def _builder_source(spec):
+    """ Source for a function that builds spec's Code directly from its parameter letters
+
+    >>> print(_builder_source(SPECS_BY_CODE["M107"]))
+    def M107(P=None, comment=""):
+        code = new(Code)
+        code.code = 'M107'
+        code.comment = comment
+        code.parameters = parameters = {}
+        if P is not None: parameters['P'] = P
+        code.checksummable = True
+        code.line_no = None
+        return code
+    """
+    letters = [field.letter for field in spec.fields]
+    lines = [f'def {spec.code}({"".join(f"{letter}=None, " for letter in letters)}comment=""):',
+             "    code = new(Code)",
+             f"    code.code = {spec.code!r}",
+             "    code.comment = comment",
+             "    code.parameters = parameters = {}"]
+    lines.extend(f"    if {letter} is not None: parameters[{letter!r}] = {letter}" for letter in letters)
+    lines.extend(["    code.checksummable = True", "    code.line_no = None", "    return code"])
+    return "\n".join(lines)
+
+
+class Builders(object):
+    """ Lazily generates, then caches as an attribute, a constructor per code in the table. """
+    def __getattr__(self, code):
+        spec = SPECS_BY_CODE.get(code)
+        if spec is None:
+            raise AttributeError(f"No spec for code {code}")
+        namespace = {"Code": Code, "new": object.__new__}
+        exec(_builder_source(spec), namespace)
+        builder = namespace[code]
+        builder.__doc__ = f"Build a {code} ({spec.helper}) Code"
+        setattr(self, code, builder)
+        return builder
+
+
+BUILDERS = Builders()
+
+
+####
+# Lookups
+#
+def spec_for(code):
+    """ The Spec for a code name, or None """
+    return SPECS_BY_CODE.get(code)
+
+
+def modal_codes(effect, value):
+    """ The codes that set a modal effect to value, in table order
+
+    >>> modal_codes('position', 'move')
+    ('G0', 'G1')
+    """
+    return tuple(spec.code for spec in SPECS if spec.modal and spec.modal.get(effect) == value)
+
+
+def modes(effect):
+    """ Map each value of a modal effect to the code that sets it
+
+    >>> modes('positioning')
+    {'absolute': 'G90', 'relative': 'G91'}
+    >>> modes('units')
+    {'in': 'G20', 'mm': 'G21'}
+    """
+    return {spec.modal[effect]: spec.code for spec in SPECS if spec.modal and effect in spec.modal}
+
+
+def parse(text):
+    """ Turn a line of text back into a Code; values are kept as written, comments are dropped.
+
+    >>> parse("M104 S200 T0 ;heat")
+    <Code(code=M104, S=200, T=0)>
+    >>> parse("G28 X Y")
+    <Code(code=G28, X=, Y=)>
+    """
+    command = text.partition(';')[0].split()
+    if not command:
+        raise ValueError("No code in line")
+    code, args = command[0], {arg[0].upper(): arg[1:] for arg in command[1:]}
+    if code in SPECS_BY_CODE:
+        try:
+            return getattr(BUILDERS, code)(**args)
+        except TypeError:
+            pass    # a parameter the table doesn't know about, let validate() complain if asked
+    return Code(code, **args)
+
+
+def validate(command):
+    """ Check a Code against its Spec, raising ValueError if it doesn't conform.
+
+    >>> validate(parse("M104 S200"))
+    <Code(code=M104, S=200)>
+    >>> validate(parse("M104 Q1"))
+    Traceback (most recent call last):
+    ...
+    ValueError: M104 does not take Q
+    >>> validate(parse("M106 Sfull"))
+    Traceback (most recent call last):
+    ...
+    ValueError: M106 S: invalid literal for int() with base 10: 'full'
+    """
+    if TOOL_CODE.match(command.code):
+        if command.parameters:
+            raise ValueError(f"{command.code} takes no parameters")
+        return command
+    spec = SPECS_BY_CODE.get(command.code)
+    if spec is None:
+        raise ValueError(f"Unknown code {command.code}")
+    fields = {field.letter: field for field in spec.fields}
+    for letter, value in command.parameters.items():
+        field = fields.get(letter)
+        if field is None:
+            raise ValueError(f"{command.code} does not take {letter}")
+        try:
+            field.type(value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{command.code} {letter}: {e}")
+    return command
+
+
+def to_helper(command):
+    """ Map a Code, or a line of text, to the name of the ops helper and the arguments that produce it.
+
+    >>> to_helper("M109 R210 T1")
+    ('wait_hotendtemp', {'celcius': 210, 'heat_to': True, 'toolidx': 1})
+    >>> to_helper("T2")
+    ('set_toolidx', {'toolidx': 2})
+    """
+    if isinstance(command, str):
+        command = parse(command)
+    validate(command)
+    tool = TOOL_CODE.match(command.code)
+    if tool:
+        return TOOL_HELPER, {'toolidx': int(tool.group(1))}
+
+    spec = SPECS_BY_CODE[command.code]
+    fields = {field.letter: field for field in spec.fields}
+    kwargs = dict(spec.fixed or {})
+    for letter, value in command.parameters.items():
+        field = fields[letter]
+        if field.arg is None:
+            continue
+        value = field.type(value)
+        if field.scale != 1:
+            value = number(value / field.scale) if value % field.scale else value // field.scale
+        kwargs[field.arg] = value
+        if field.implies:
+            kwargs.update(field.implies)
+    return spec.helper, kwargs
+
+
+def helpers():
+    """ Names of the ops helpers, table order, without duplicates """
+    names = [TOOL_HELPER] + [spec.helper for spec in SPECS] + list(COMPOSITES)
+    return list(dict.fromkeys(names))
+
+
+def helper(name):
+    """ The ops helper function called 'name' """
+    import ops      # ops builds its codes from this module
+    if name not in helpers():
+        raise ValueError(f"Unknown helper {name}")
+    return getattr(ops, name)
+
+
+def helper_codes(name):
+    """ The codes a helper can produce """
+    if name == TOOL_HELPER:
+        return ["T<n>"]
+    return [spec.code for spec in SPECS if spec.helper == name]
+
+
+def convert_args(name, kwargs):
+    """ Convert text arguments, e.g. from the repl, to the types the helper takes.
+
+    >>> convert_args("move", {"x": "10", "feed_rate": "2.5", "extruding": "true"})
+    {'x': 10, 'feed_rate': 2.5, 'extruding': True}
+    """
+    types = {field.arg: field.type for spec in SPECS if spec.helper == name for field in spec.fields if field.arg}
+    converted = {}
+    for arg, value in kwargs.items():
+        if isinstance(value, str) and value.lower() in ('true', 'false'):
+            value = value.lower() == 'true'
+        elif arg in types and types[arg] not in (flag, detail):
+            value = types[arg](value)
+        converted[arg] = value
+    return converted
@@ -2,7 +2,56 @@
 
 import codes
 import ops
+import queue
+import registry
 import sys
+import template
+import threading
+
+
+""" Things Run treats as a single command, rather than a sequence of them """
+SINGLE_COMMANDS = (codes.Code, str, template.BoundTemplate)
+
+
+def parse_command(text):
+    """ Turn a text line, e.g. "G0 X0 Y1 ;comment", into a Code. Comments are discarded, so a
+    line with nothing but a comment (or nothing at all) gives None.
+
+    >>> parse_command("G0 X0 Y1 ;comment")
+    <Code(code=G0, X=0, Y=1)>
+    >>> parse_command("M110 N5")
+    <Code(code=M110, comment="set line no", line_no=4, N=5)>
+    >>> parse_command("  ;just a comment") is None
+    True
+    """
+    if not text.partition(';')[0].strip():
+        return None
+    command = registry.parse(text)
+    if command.code == "M110" and 'N' in command.parameters:
+        return ops.set_lineno(int(command.parameters['N']))
+    return command
+
+
+def _text_command(text):
+    """ A text line as a Code that emits it as written, less any comment, for Run to send. Parsing
+    it into parameters could rewrite it, e.g. repeated or free text arguments. M110 is parsed so
+    Run can follow the line numbering. None for a line with nothing but a comment.
+
+    >>> _text_command("M117 Layer 1 of 100 ;progress").emit(line_no=5, checksum=True)
+    'N5 M117 Layer 1 of 100*107'
+    >>> _text_command("M110 N5")
+    <Code(code=M110, comment="set line no", line_no=4, N=5)>
+    """
+    text = text.partition(';')[0].strip()
+    if not text:
+        return None
+    if text.split(None, 1)[0] == "M110":
+        return parse_command(text)
+    return codes.Code(text)
+
+
+def _forget(command):
+    """ Stands in for cmd_hist.append when a Run isn't keeping history """
 
 
 # -----------------------------------------------------------------------------
@@ -41,12 +90,16 @@ class GriffinWriter(Writer):
 # -----------------------------------------------------------------------------
 #
 class Run(object):
-    """ Encapsulation of a run of commands, with the ability to queue and run commands while tracking line numbers for checksums """
+    """ Encapsulation of a run of commands, with the ability to queue and run commands while tracking line numbers for checksums
+
+    :param keep_history: Keep every command sent in cmd_hist; turn off for long or large jobs
+    """
 
-    def __init__(self, without_comments=False, with_checksum=False, writer=Writer()):
+    def __init__(self, without_comments=False, with_checksum=False, writer=Writer(), keep_history=True):
         self.with_checksum = with_checksum
         self.without_comments = without_comments
         self.writer = writer
+        self.keep_history = keep_history
 
         self.reset()
 
@@ -66,7 +119,7 @@ class Run(object):
         >>> r.cmd_queue
         ['a', 'b', 'x']
         """
-        if isinstance(commands, (str, codes.Code)):
+        if isinstance(commands, SINGLE_COMMANDS):
             self.cmd_queue.append(commands)
         else:
             self.cmd_queue.extend(commands)
@@ -78,22 +131,36 @@ class Run(object):
         # User passing us a text line, e.g. "G0 X0 Y1"
         if isinstance(commands, bytes):
             commands = commands.encode()
-        if isinstance(commands, (codes.Code, str)):
+        if isinstance(commands, SINGLE_COMMANDS):
             commands = (commands,)
+        self._send(commands)
 
+    def _send(self, commands):
+        """ Emit and write commands, tracking the line number. """
         checksum, without_comments, writer = self.with_checksum, self.without_comments, self.writer
-        history = self.cmd_hist.append
+        history = self.cmd_hist.append if self.keep_history else _forget
         for command in commands:
             if isinstance(command, str):
-                command, _, comment = command.partition(';')
-                command = command.strip()
-                tokens = command.split('\s+')
-                code, args = tokens[0], {arg[0]: arg[1:] for arg in tokens[1:]}
-                command = codes.Code(code, **args)
+                command = _text_command(command)
+                if command is None:
+                    continue
+            elif isinstance(command, template.BoundTemplate):
+                # Precompiled: the template patches in the values, line numbers and checksums.
+                if self.line_no is None:
+                    self.line_no = 0
+                    self._send((ops.set_lineno(1),))
+                lines, self.line_no = command.render(self.line_no, checksum=checksum, without_comments=without_comments)
+                for line in lines:
+                    writer(line)
+                history(command)
+                continue
 
-            if self.line_no is None and command.code != "M110":
-                self.line_no = 0
-                self.execute_immediate(ops.set_lineno(1))
+            if self.line_no is None:
+                if command.code != "M110":
+                    self.line_no = 0
+                    self._send((ops.set_lineno(1),))
+                else:
+                    self.line_no = command.line_no
 
             writer(command.emit(checksum=checksum, without_comments=without_comments, line_no=self.line_no))
             if command.line_no is not None:
@@ -103,9 +170,122 @@ class Run(object):
     def execute(self, commands=None):
         """ Executes optional commands after first executing the queue. """
         queue, self.cmd_queue = self.cmd_queue, []
-        if isinstance(commands, (codes.Code, str, bytes)):
+        if isinstance(commands, (*SINGLE_COMMANDS, bytes)):
             queue.append(commands)
         else:
             queue.extend(commands or [])
         if queue:
             self.execute_immediate(queue)
+
+
+# -----------------------------------------------------------------------------
+#
+class BackgroundRun(Run):
+    """ A Run where execution happens on a dedicated sender thread, so that generating commands
+    overlaps with emitting and writing them.
+
+    execute_immediate/execute enqueue onto a bounded queue and return straight away, blocking only
+    when the queue is full. Line numbers are assigned by the sender thread, so they stay strictly
+    ordered however many threads are producing; each call's commands are sent contiguously.
+
+    >>> with BackgroundRun() as r:
+    ...     r.execute("G28")
+    ...     r.join()
+    M110 N1 ;set line no
+    G28
+
+    :param maxsize: Maximum number of chunks waiting to be sent before producers block
+    :param chunk_size: Commands are handed to the sender thread in chunks of up to this many
+    """
+    def __init__(self, without_comments=False, with_checksum=False, writer=Writer(), keep_history=True, maxsize=64, chunk_size=64):
+        super().__init__(without_comments=without_comments, with_checksum=with_checksum, writer=writer, keep_history=keep_history)
+        self.chunk_size = chunk_size
+        self.send_queue = queue.Queue(maxsize)
+        self.producer_lock = threading.RLock()
+        self.error = None
+        self.closed = False
+        self.sender = threading.Thread(target=self._sender, name="BackgroundRun-sender", daemon=True)
+        self.sender.start()
+
+    def _sender(self):
+        """ Sender thread: emit and write chunks until told to stop with None. """
+        send_queue, send = self.send_queue, self._send
+        while True:
+            chunk = send_queue.get()
+            try:
+                if chunk is None:
+                    return
+                if self.error is None:
+                    send(chunk)
+            except Exception as e:
+                self.error = e      # discard everything after, and report it to the producer
+            finally:
+                send_queue.task_done()
+
+    def _check_open(self):
+        if self.closed:
+            raise ValueError("BackgroundRun is closed")
+
+    def _check_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def queue(self, commands):
+        with self.producer_lock:
+            self._check_open()
+            super().queue(commands)
+
+    def execute_immediate(self, commands):
+        """ Enqueue the given commands for the sender thread, without consulting the queue. """
+        if not commands:
+            return
+        if isinstance(commands, (*SINGLE_COMMANDS, bytes)):
+            commands = (commands,)
+        self._check_error()
+
+        put, chunk_size = self.send_queue.put, self.chunk_size
+        with self.producer_lock:
+            # Nothing would ever send it, and join() would wait forever.
+            self._check_open()
+            chunk = []
+            for command in commands:
+                chunk.append(command)
+                if len(chunk) >= chunk_size:
+                    put(chunk)
+                    chunk = []
+            if chunk:
+                put(chunk)
+
+    def execute(self, commands=None):
+        with self.producer_lock:
+            super().execute(commands)
+
+    def join(self):
+        """ Wait for everything enqueued so far to be written, and raise any error the sender hit. """
+        self.send_queue.join()
+        self._check_error()
+
+    flush = join
+
+    def close(self):
+        """ Flush and stop the sender thread. Nothing more can be queued or executed after this. """
+        with self.producer_lock:
+            self.closed = True
+        if self.sender.is_alive():
+            self.send_queue.put(None)
+            self.sender.join()
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+            return
+        # Already unwinding: still stop the sender, but don't let its error replace the one in flight.
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,150 @@
+#! *python3:doctest-modules*
+
+"""
+Precompiled, parametrized command sequences.
+
+Start/end sequences are the same handful of codes every time with a few values changed. A Template
+emits a sequence of Codes once, with Param placeholders standing in for the values that change,
+and keeps the text of each line ready to be filled in. Binding values produces something Run can
+execute or queue like a Code: the values, line numbers and checksums are patched into the
+prepared text without building or emitting any Codes.
+
+    import ops, run
+    from template import Param, Template
+
+    start_seq = Template([
+        ops.home_axis(),
+        ops.set_units('mm'),
+        ops.set_bedtemp(Param("bed")),
+        ops.wait_hotendtemp(Param("hotend")),
+    ], bed=60)
+    script = run.Run(with_checksum=True)
+    script.execute(start_seq.bind(hotend=210))
+
+Placeholders can be used for any helper argument that is passed through to the Code as-is.
+"""
+
+
+####
+# Constants
+#
+""" Marks the start and end of a placeholder's name in the compiled text """
+MARK = "\x00"
+
+
+def _xor(text):
+    """ Checksum contribution of some text: the xor of its characters """
+    cs = 0
+    for c in text.encode():
+        cs ^= c
+    return cs
+
+
+# -----------------------------------------------------------------------------
+#
+class Param(object):
+    """ Placeholder for a value that is supplied when the Template is bound.
+
+    >>> from codes import Code
+    >>> Code("M104", s=Param("temp")).emit() == "M104 S" + MARK + "temp" + MARK
+    True
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return f"{MARK}{self.name}{MARK}"
+
+    def __repr__(self):
+        return f"Param({self.name!r})"
+
+
+# -----------------------------------------------------------------------------
+#
+class Template(object):
+    """ A sequence of commands compiled once into text with placeholders.
+
+    >>> from codes import Code
+    >>> t = Template([Code("M104", s=Param("temp"), comment="heat"), Code("G28")], temp=0)
+    >>> t.names
+    ('temp',)
+    >>> t.render(5, checksum=True, temp=210)
+    (['N5 M104 S210*99 ;heat', 'N6 G28*21'], 7)
+    >>> t.render()
+    (['M104 S0 ;heat', 'G28'], None)
+
+    :param commands: Codes to compile, which may include Param values
+    :param defaults: Values for any Params not given when binding/rendering
+    """
+    def __init__(self, commands, **defaults):
+        self.defaults = defaults
+        self.lines = []
+        names = []
+        for command in commands:
+            if command.code == "M110":
+                raise ValueError("Templates can't contain M110, line numbering is left to Run")
+            text = command.emit(without_comments=True)
+            parts = text.split(MARK)
+            # Even parts are fixed text, odd parts are placeholder names.
+            fixed, params = parts[0::2], tuple(parts[1::2])
+            pattern = "".join(part.replace("{", "{{").replace("}", "}}") + (f"{{{params[idx]}}}" if idx < len(params) else "")
+                              for idx, part in enumerate(fixed))
+            fixed_xor = _xor("".join(fixed))
+            comment = f" ;{command.comment}" if command.comment else ""
+            self.lines.append((command.checksummable, pattern if params else text, params, fixed_xor, comment))
+            names.extend(name for name in params if name not in names)
+        self.names = tuple(names)
+
+    def render(self, line_no=None, checksum=False, without_comments=False, **values):
+        """ Produce the text lines, and the line number following them.
+
+        :param line_no: Line number of the first checksummed line
+        :param checksum: Include line numbers and checksums
+        """
+        if checksum and not isinstance(line_no, int):
+            raise ValueError("Can't checksum without a line number")
+        if values or self.defaults:
+            values = {**self.defaults, **values}
+        missing = [name for name in self.names if name not in values]
+        if missing:
+            raise ValueError(f"Template values missing for: {', '.join(missing)}")
+        strings = {name: str(values[name]) for name in self.names}
+        xors = {name: _xor(text) for name, text in strings.items()}
+
+        lines = []
+        for checksummable, text, params, cs, comment in self.lines:
+            if params:
+                text = text.format_map(strings)
+                for name in params:
+                    cs ^= xors[name]
+            if checksum and checksummable:
+                prefix = f"N{line_no} "
+                text = f"{prefix}{text}*{cs ^ _xor(prefix)}"
+                line_no += 1
+            if comment and not without_comments:
+                text += comment
+            lines.append(text)
+        return lines, line_no
+
+    def bind(self, **values):
+        """ Fix the values, giving something Run can execute or queue like a Code """
+        return BoundTemplate(self, values)
+
+    def __repr__(self):
+        return f"<Template({len(self.lines)} lines, names={self.names})>"
+
+
+# -----------------------------------------------------------------------------
+#
+class BoundTemplate(object):
+    """ A Template with its values, ready for Run to send. """
+    def __init__(self, template, values):
+        self.template = template
+        self.values = values
+
+    def render(self, line_no=None, checksum=False, without_comments=False):
+        return self.template.render(line_no, checksum=checksum, without_comments=without_comments, **self.values)
+
+    def __repr__(self):
+        return f"<BoundTemplate({len(self.template.lines)} lines, values={self.values})>"
+
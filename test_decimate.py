@@ -0,0 +1,117 @@
+#! *python3-tests:doctest-modules*
+
+import math
+import unittest
+
+import decimate
+import ops
+import run
+
+
+def circle(segments, radius=10.0, feed_rate=50):
+    """ A circle of short extruding segments, in relative extrusion mode """
+    job = [ops.set_extrudemode("relative"), ops.move(x=radius, y=0, feed_rate=feed_rate)]
+    for step in range(1, segments + 1):
+        angle = 2 * math.pi * step / segments
+        job.append(ops.extrude(x=round(radius * math.cos(angle), 4), y=round(radius * math.sin(angle), 4), filament=0.01))
+    return job
+
+
+def points(commands):
+    return [(float(c.parameters['X']), float(c.parameters['Y'])) for c in commands if 'X' in c.parameters]
+
+
+class TestDecimator(unittest.TestCase):
+    def test_fast_link(self):
+        job = circle(200)
+        decimator = decimate.AdaptiveDecimator(lambda: 10000.0)
+        self.assertEqual(list(decimator(job)), job)
+        self.assertFalse(decimator.active)
+
+    def test_unknown_rate(self):
+        job = circle(200)
+        self.assertEqual(list(decimate.AdaptiveDecimator(lambda: None)(job)), job)
+
+    def test_slow_link(self):
+        # 200 segments of ~0.31mm at 50mm/s need ~160 lines/s.
+        job = circle(200)
+        tolerance = 0.05
+        decimator = decimate.AdaptiveDecimator(lambda: 50.0, tolerance=tolerance)
+        with self.assertLogs("decimate", level="INFO") as logs:
+            got = list(decimator(job))
+        self.assertTrue(decimator.active)
+        self.assertLess(len(got), len(job) / 2)
+        self.assertEqual(decimator.merged, len(job) - len(got))
+        self.assertIn("decimating", logs.output[0])
+        self.assertTrue(any("merged" in line for line in logs.output[1:]))
+
+        # Same start and end, same filament, and the original points stay within tolerance.
+        self.assertEqual(got[:2], job[:2])
+        self.assertEqual(got[-1].parameters['X'], job[-1].parameters['X'])
+        self.assertAlmostEqual(sum(c.parameters.get('E', 0) for c in got), 2.0)
+        path = points(got)
+        for px, py in points(job):
+            self.assertLessEqual(min(decimate._deviation(px, py, *a, *b) for a, b in zip(path, path[1:])),
+                                 tolerance + 1e-9)
+
+    def test_backoff(self):
+        rates = iter([50.0] * 3 + [10000.0] * 100)
+        decimator = decimate.AdaptiveDecimator(lambda: next(rates), lookahead=20)
+        with self.assertLogs("decimate", level="INFO") as logs:
+            got = list(decimator(circle(200)))
+        self.assertFalse(decimator.active)
+        self.assertTrue(any("caught up" in line for line in logs.output))
+        self.assertEqual(got[-140:], circle(200)[-140:])
+
+    def test_barriers(self):
+        job = [ops.move(x=0, y=0, feed_rate=50), ops.extrude(x=0.1, filament=0.01), ops.extrude(x=0.2, filament=0.02),
+               ops.move(z=1), ops.extrude(x=0.3, filament=0.03), ops.extrude(x=0.4, filament=0.04),
+               ops.set_positioning("relative"), ops.extrude(x=0.1, filament=0.01), ops.extrude(x=0.1, filament=0.01)]
+        got = list(decimate.AdaptiveDecimator(lambda: 1.0)(job))
+        # Each side of the Z move merges (absolute E keeps the last value), relative moves are left alone.
+        self.assertEqual([c.emit(without_comments=True) for c in got],
+                         ["G0 X0 Y0 F3000", "G1 X0.2 E0.02", "G0 Z1", "G1 X0.4 E0.04", "G91",
+                          "G1 X0.1 E0.01", "G1 X0.1 E0.01"])
+
+    def test_slow_producer_fast_link(self):
+        # The job only produces a line a second for a while, so that is all the printer acks, but
+        # it acks each line as soon as it arrives: the link isn't behind, and the dense circle
+        # that follows must go through untouched.
+        now = [0.0]
+        acks = decimate.AckRate(clock=lambda: now[0])
+        sent = []
+        def device(line):
+            sent.append(line)
+            acks.response("ok")
+
+        def job():
+            for _ in range(10):
+                now[0] += 1.0
+                yield ops.get_temp()
+            yield from circle(200)
+
+        decimator = decimate.AdaptiveDecimator(acks.limit)
+        run.Run(writer=acks.counting(device)).execute_immediate(decimator(job()))
+        self.assertEqual(decimator.merged, 0)
+        self.assertFalse(decimator.active)
+        self.assertEqual(len(sent), 1 + 10 + 202)
+
+    def test_saturated_link(self):
+        # The printer acks 50 lines a second and falls further behind with every line.
+        now = [0.0]
+        acks = decimate.AckRate(clock=lambda: now[0])
+        write = acks.counting(lambda line: None)
+        for _ in range(20):
+            write("M105")
+            acks.response("ok")
+            now[0] += 0.02
+
+        decimator = decimate.AdaptiveDecimator(acks.limit)
+        run.Run(writer=write).execute_immediate(decimator(circle(200)))
+        self.assertTrue(decimator.active)
+        self.assertGreater(decimator.merged, 100)
+
+    def test_ack_rate(self):
+        acks = decimate.AckRate()
+        acks.response("echo:busy")
+        self.assertIsNone(acks.rate())
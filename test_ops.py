@@ -45,10 +45,10 @@ class TestCase(unittest.TestCase):
         self.expect_gcode(ops.set_extrudemode("absolute"), "M82", {})
         self.expect_gcode(ops.set_extrudemode("relative"), "M83", {})
 
-        self.expect_gcode(ops.set_units("mm"), "G20", {})
-        self.expect_gcode(ops.set_units("millimeter"), "G20", {})
-        self.expect_gcode(ops.set_units("in"), "G21", {})
-        self.expect_gcode(ops.set_units("inch"), "G21", {})
+        self.expect_gcode(ops.set_units("mm"), "G21", {})
+        self.expect_gcode(ops.set_units("millimeter"), "G21", {})
+        self.expect_gcode(ops.set_units("in"), "G20", {})
+        self.expect_gcode(ops.set_units("inch"), "G20", {})
 
         self.expect_gcode(ops.set_positioning("absolute"), "G90", {})
         self.expect_gcode(ops.set_positioning("absolute"), "G90", {})
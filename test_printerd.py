@@ -0,0 +1,184 @@
+#! *python3-tests:doctest-modules*
+
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import ops
+import printerd
+import recorder
+import run
+from template import Param, Template
+
+
+class TestPrinterDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "printer.sock")
+        self.sent = []
+        def writer(line):
+            self.sent.append(line)
+            device(line)
+        device = recorder.FakeDevice(None)
+        self.server = printerd.PrinterDaemon(self.path, writer)
+        device.on_response = self.server.response
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmpdir.cleanup()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_submit(self):
+        started = time.perf_counter()
+        with printerd.PrinterClient(self.path) as client:
+            self.assertLess(time.perf_counter() - started, 0.5)
+            self.assertTrue(client.ping())
+            self.assertEqual(client.submit([ops.home_axis(), "G0 X1 ;comment", ops.set_lineno(1)]), 2)
+            client.submit(Template([ops.set_hotendtemp(Param("temp"))]).bind(temp=200))
+            client.sync()
+        self.assertEqual([line.split('*')[0] for line in self.sent],
+                         ["N0 M110 N1", "N1 G28", "N2 G0 X1", "N3 M104 S200"])
+
+    def test_shared(self):
+        responses = []
+        with printerd.PrinterClient(self.path) as first, printerd.PrinterClient(self.path) as second:
+            second.subscribe(responses.append)
+            def produce(client, axis):
+                for _ in range(5):
+                    client.submit([ops.move(**{axis: i + 1}) for i in range(10)])
+            producers = [threading.Thread(target=produce, args=(client, axis))
+                         for client, axis in ((first, 'x'), (second, 'y'))]
+            for producer in producers:
+                producer.start()
+            for producer in producers:
+                producer.join()
+            first.sync()
+            second.unsubscribe()
+
+        self.assertEqual(len(self.sent), 101)
+        self.assertEqual([int(line.split()[0][1:]) for line in self.sent], list(range(101)))
+        # Batches stay together.
+        for start in range(1, 101, 10):
+            self.assertEqual(len({line.split()[2][0] for line in self.sent[start:start + 10]}), 1)
+        self.assertEqual(responses, ["ok"] * 101)
+
+    def test_writer_protocol(self):
+        with printerd.PrinterClient(self.path) as client:
+            script = run.Run(writer=client)
+            script.execute([ops.home_axis(), ops.get_temp()])
+            client.sync()
+        # The client Run's own M110 is dropped, numbering is the daemon's.
+        self.assertEqual([line.split('*')[0] for line in self.sent], ["N0 M110 N1", "N1 G28", "N2 M105"])
+
+    def test_checksummed_writer(self):
+        with printerd.PrinterClient(self.path) as client:
+            script = run.Run(writer=client, with_checksum=True)
+            script.execute([ops.home_axis(), ops.get_temp()])
+            client.sync()
+        self.assertEqual([line.split('*')[0] for line in self.sent], ["N0 M110 N1", "N1 G28", "N2 M105"])
+
+    def test_errors(self):
+        with printerd.PrinterClient(self.path) as client:
+            with self.assertRaises(RuntimeError):
+                client.request(["!bogus"])
+            self.assertTrue(client.ping())
+            # A bad line rejects its whole batch, and nothing of it reaches the printer.
+            with self.assertRaisesRegex(RuntimeError, "M104 S"):
+                client.request(["G28", "M104 Shot", "!go"])
+            self.assertEqual(client.request(["  ;comment only", "", "G28 ;home", "!go"]), "ok 1")
+            client.sync()
+        self.assertEqual([line.split('*')[0] for line in self.sent], ["N0 M110 N1", "N1 G28"])
+
+    def test_socket_in_use(self):
+        with self.assertRaises(OSError):
+            printerd.PrinterDaemon(self.path, self.sent.append)
+        with printerd.PrinterClient(self.path) as client:
+            self.assertTrue(client.ping())
+
+        # A socket nobody is serving is left over from a daemon that died, and is replaced.
+        stale = os.path.join(self.tmpdir.name, "stale.sock")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(stale)
+        server = printerd.PrinterDaemon(stale, self.sent.append)
+        server.server_close()
+
+    def test_keepalive(self):
+        self.server.keepalive = 0.05
+        time.sleep(0.2)
+        self.server.sync()
+        self.assertIn("M105", self.sent[-1])
+
+    def test_keepalive_error(self):
+        def unplugged(line):
+            raise IOError("unplugged")
+        self.server.script.writer = unplugged       # bypass the daemon's own error handling
+        with self.assertLogs(level="WARNING") as logs:
+            self.server.keepalive = 0.02
+            time.sleep(0.2)
+            self.server.keepalive = None
+        self.assertIn("keepalive failed: unplugged", logs.output[0])
+        self.assertTrue(self.thread.is_alive())
+        try:
+            self.server.sync()      # collect the last error, if it is still pending
+        except IOError:
+            pass
+
+    def test_link_error(self):
+        def writer(line):
+            if "X666" in line:
+                raise IOError("unplugged")
+            self.sent.append(line)
+        self.server.writer = writer
+        with printerd.PrinterClient(self.path) as first, printerd.PrinterClient(self.path) as second:
+            with self.assertLogs(level="WARNING"):
+                first.submit(["G0 X666", "G0 X1"])
+                self.server.sync()
+            # Only the client whose lines may have been lost hears about it, once, and nothing else is dropped.
+            second.submit("G28")
+            second.sync()
+            with self.assertRaisesRegex(RuntimeError, "printer link failed.*unplugged"):
+                first.sync()
+            first.submit("M105")
+            first.sync()
+        self.assertEqual([line.split('*')[0] for line in self.sent], ["N0 M110 N1", "N2 G0 X1", "N3 G28", "N4 M105"])
+        self.assertEqual(self.server.script.cmd_hist, [])
+
+    def test_timeout(self):
+        gate = threading.Event()
+        self.server.writer = lambda line: gate.wait()
+        with printerd.PrinterClient(self.path, timeout=0.05) as client:
+            client.submit("G28")
+            with self.assertRaises(TimeoutError):
+                client.sync()
+            # The late reply to the sync must not be taken as the answer to anything else.
+            with self.assertRaises(ConnectionError):
+                client.ping()
+        gate.set()
+
+    def test_slow_subscriber(self):
+        self.server.response_backlog = 50
+        responses = []
+        stuck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stuck.connect(self.path)
+        stuck.sendall(b"!subscribe\n")
+        self.assertEqual(stuck.recv(3), b"ok\n")
+        with printerd.PrinterClient(self.path, on_response=responses.append) as client:
+            client.subscribe()
+            with self.assertLogs(level="WARNING"):
+                started = time.perf_counter()
+                for idx in range(2000):
+                    self.server.response(f"{idx:04d} " + "x" * 1000)
+                    if idx % 10 == 0:
+                        time.sleep(0.001)   # a printer doesn't reply in one burst
+            self.assertLess(time.perf_counter() - started, 5)
+            self.assertEqual(len(self.server.subscribers), 1)
+            client.unsubscribe()
+        stuck.close()
+        self.assertEqual(len(responses), 2000)
@@ -0,0 +1,64 @@
+#! *python3-tests:doctest-modules*
+
+import io
+import time
+import unittest
+
+import ops
+import recorder
+import run
+
+
+class TestRecorder(unittest.TestCase):
+    def record_session(self, commands, ack_delay=0.0):
+        stream = io.BytesIO()
+        with recorder.Recorder(stream) as rec:
+            device = recorder.FakeDevice(rec.received, ack_delay=ack_delay)
+            script = run.Run(with_checksum=True, without_comments=True, writer=recorder.RecordingWriter(device, rec))
+            script.execute(commands)
+        stream.seek(0)
+        return list(recorder.read_trace(stream))
+
+    def test_round_trip(self):
+        events = self.record_session([ops.home_axis(), ops.get_temp()])
+        self.assertEqual([e.kind for e in events], [recorder.SENT, recorder.RECEIVED] * 3)
+        self.assertEqual(events[0].text, "N0 M110 N1*124")
+        self.assertEqual(events[2].text, "N1 G28*18")
+        timestamps = [e.ns for e in events]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_bad_trace(self):
+        with self.assertRaises(ValueError):
+            list(recorder.read_trace(io.BytesIO(b"not a trace")))
+
+    def test_replay_matches_original(self):
+        commands = [ops.home_axis(), ops.move(x=1, y=2), ops.set_lineno(10), ops.move(x=3),
+                    "M117 Layer 1 of 100", "G1 X1 X2"]
+        events = self.record_session(commands)
+        original = [e.text for e in events if e.kind == recorder.SENT]
+
+        sent = []
+        recorder.replay(events, sent.append, speed=0)
+        self.assertEqual(sent, original)
+
+    def test_percentiles(self):
+        stats = recorder.summarize(range(1000000, 101000000, 1000000))
+        self.assertEqual((stats.p50, stats.p90, stats.p99, stats.max), (50.0, 90.0, 99.0, 100.0))
+
+    def test_replay_timing(self):
+        events = [recorder.TraceEvent(recorder.SENT, 0, "M110 N1"),
+                  recorder.TraceEvent(recorder.SENT, 1000, "G28"),
+                  recorder.TraceEvent(recorder.SENT, 100000000, "M105")]
+        sent = []
+        start = time.perf_counter()
+        recorder.replay(events, sent.append, speed=2)
+        elapsed = time.perf_counter() - start
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(sent, ["M110 N1", "G28", "M105"])
+
+    def test_replay_latencies(self):
+        events = self.record_session([ops.move(x=i + 1) for i in range(5)], ack_delay=0.001)
+        stats = recorder.summarize(recorder.latencies(events))
+        self.assertEqual(stats.count, 6)
+        self.assertGreaterEqual(stats.min, 1.0)
@@ -0,0 +1,91 @@
+#! *python3-tests:doctest-modules*
+
+import unittest
+
+import ops
+import registry
+from codes import Code
+
+
+# One or more calls per helper, with the ops helper's arguments.
+EXAMPLES = [
+    ("set_toolidx", {"toolidx": 3}),
+    ("set_lineno", {"number": 12}),
+    ("set_hotendtemp", {"celcius": 210}),
+    ("set_hotendtemp", {"celcius": 210, "toolidx": 1, "max_auto": 230}),
+    ("get_temp", {}),
+    ("get_temp", {"toolidx": 0}),
+    ("wait_hotendtemp", {"celcius": 200, "toolidx": 1}),
+    ("wait_hotendtemp", {"celcius": 200, "heat_to": True, "max_auto": 220}),
+    ("wait_bedtemp", {"celcius": 60}),
+    ("wait_bedtemp", {"celcius": 60, "heat_to": True}),
+    ("set_bedtemp", {"celcius": 55}),
+    ("set_extrudemode", {"ext_mode": "absolute"}),
+    ("set_extrudemode", {"ext_mode": "relative"}),
+    ("set_units", {"unit": "mm"}),
+    ("set_units", {"unit": "in"}),
+    ("set_positioning", {"pos_mode": "absolute"}),
+    ("set_positioning", {"pos_mode": "relative"}),
+    ("set_fanspeed", {"speed": 255, "fanidx": 1}),
+    ("set_fanoff", {}),
+    ("set_fanoff", {"fanidx": 2}),
+    ("home_axis", {}),
+    ("home_axis", {"x": True, "z": True, "optional": True}),
+    ("set_axisstepsperunit", {"steps": 0}),
+    ("set_axisstepsperunit", {"x_units": 80, "y_units": 80.5}),
+    ("move", {"x": 0, "y": 0}),
+    ("move", {"x": 1.5, "z": 0.2, "feed_rate": 50}),
+    ("move", {"x": 10, "filament": 0.4}),
+    ("get_position", {}),
+    ("get_position", {"detail": True}),
+    ("get_position", {"detail": False}),
+]
+
+
+class TestRegistry(unittest.TestCase):
+    def test_round_trip(self):
+        for name, kwargs in EXAMPLES:
+            with self.subTest(helper=name, kwargs=kwargs):
+                command = getattr(ops, name)(**kwargs)
+                registry.validate(command)
+                text = command.emit(without_comments=True)
+                parsed = registry.parse(text)
+                # parse() keeps values as written, so compare them as text.
+                self.assertEqual(parsed.code, command.code)
+                self.assertEqual(parsed.parameters, {k: str(v) for k, v in command.parameters.items()})
+                self.assertEqual(parsed.emit(), text)
+
+                helper, args = registry.to_helper(text)
+                self.assertEqual(helper, name)
+                self.assertEqual(registry.helper(helper)(**args), command)
+
+    def test_builders_match_code(self):
+        for spec in registry.SPECS:
+            values = {field.letter: ('' if field.type is registry.flag else 1) for field in spec.fields}
+            built = getattr(registry.BUILDERS, spec.code)(comment="c", **values)
+            expected = Code(spec.code, comment="c", **values)
+            self.assertEqual(vars(built), vars(expected))
+            # Cached after the first use.
+            self.assertIn(spec.code, vars(registry.BUILDERS))
+
+        with self.assertRaises(AttributeError):
+            registry.BUILDERS.M999
+
+    def test_every_helper_is_listed(self):
+        public = {name for name in dir(ops) if name[0].islower() and callable(getattr(ops, name))}
+        self.assertEqual(set(registry.helpers()), public)
+        with self.assertRaises(ValueError):
+            registry.helper("Bool")
+
+    def test_validate(self):
+        for text in ("M999", "G28 X1", "M114 Dx", "T1 S1", "G0 Xabc"):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                registry.validate(registry.parse(text))
+        # Unknown parameters still parse.
+        self.assertEqual(registry.parse("M104 S200 Q1").parameters, {'S': '200', 'Q': '1'})
+        with self.assertRaises(ValueError):
+            registry.parse(" ;just a comment")
+
+    def test_convert_args(self):
+        self.assertEqual(registry.convert_args("set_fanspeed", {"speed": "128", "fanidx": "1"}), {"speed": 128, "fanidx": 1})
+        self.assertEqual(registry.convert_args("home_axis", {"x": "true", "y": "False"}), {"x": True, "y": False})
@@ -1,5 +1,6 @@
 #! *python3-tests:doctest-modules*
 
+import threading
 import unittest
 from mock import MagicMock
 
@@ -48,3 +49,94 @@ class TestRun(unittest.TestCase):
             self.assertEqual(r.line_no, 1)
             self.assertEqual(r.cmd_queue, [])
             self.assertEqual(r.cmd_hist, [setline_cmd, home_cmd, temp_cmd])
+
+    def test_comment_lines(self):
+        sent = []
+        r = run.Run(writer=sent.append, without_comments=True)
+        r.execute_immediate(["; start of job", "G28 ;home", "   ", "  ; indented comment", "M105"])
+        self.assertEqual(sent, ["M110 N1", "G28", "M105"])
+
+
+class TestBackgroundRun(unittest.TestCase):
+    def test_background_run(self):
+        sent = []
+        with run.BackgroundRun(with_checksum=True, without_comments=True, writer=sent.append) as r:
+            r.queue(ops.home_axis())
+            r.execute(ops.move(x=i + 1) for i in range(200))
+            r.join()
+            self.assertEqual(len(sent), 202)
+            self.assertEqual(sent[0], "N0 M110 N1*124")
+            self.assertTrue(sent[1].startswith("N1 G28*"))
+            self.assertTrue(sent[-1].startswith("N201 G0 X200*"))
+            self.assertEqual(r.line_no, 202)
+
+    def test_backpressure(self):
+        release = threading.Event()
+        sent = []
+        def writer(line):
+            release.wait()
+            sent.append(line)
+
+        r = run.BackgroundRun(writer=writer, maxsize=1, chunk_size=1)
+        producer = threading.Thread(target=r.execute_immediate, args=(["G28"] * 10,))
+        producer.start()
+        producer.join(timeout=0.2)
+        self.assertTrue(producer.is_alive())     # blocked on the full queue
+        release.set()
+        producer.join()
+        r.close()
+        self.assertEqual(len(sent), 11)
+
+    def test_multiple_producers(self):
+        sent = []
+        with run.BackgroundRun(with_checksum=True, writer=sent.append, maxsize=4, chunk_size=8) as r:
+            def produce(axis):
+                r.execute_immediate([ops.move(**{axis: i + 1}) for i in range(100)])
+            producers = [threading.Thread(target=produce, args=(axis,)) for axis in "xyz"]
+            for producer in producers:
+                producer.start()
+            for producer in producers:
+                producer.join()
+            r.join()
+
+        self.assertEqual(len(sent), 301)
+        line_nos = [int(line.split()[0][1:]) for line in sent]
+        self.assertEqual(line_nos, list(range(301)))
+        # Each producer's commands go out contiguously.
+        axes = [line.split()[2][0] for line in sent[1:]]
+        for block in range(0, 300, 100):
+            self.assertEqual(len(set(axes[block:block + 100])), 1)
+
+    def test_sender_error(self):
+        def writer(line):
+            raise IOError("unplugged")
+
+        r = run.BackgroundRun(writer=writer)
+        r.execute_immediate("G28")
+        with self.assertRaises(IOError):
+            r.join()
+        r.close()
+
+    def test_exit_keeps_exception(self):
+        def writer(line):
+            raise IOError("unplugged")
+
+        with self.assertRaises(KeyError):
+            with run.BackgroundRun(writer=writer) as r:
+                r.execute_immediate("G28")
+                r.send_queue.join()
+                raise KeyError("caller's error")
+        self.assertFalse(r.sender.is_alive())
+
+        with self.assertRaises(IOError):
+            with run.BackgroundRun(writer=writer) as r:
+                r.execute_immediate("G28")
+
+    def test_closed(self):
+        r = run.BackgroundRun(writer=[].append)
+        r.close()
+        for call in (r.execute_immediate, r.queue, r.execute):
+            with self.assertRaises(ValueError):
+                call("G28")
+        r.join()
+        r.close()
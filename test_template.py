@@ -0,0 +1,64 @@
+#! *python3-tests:doctest-modules*
+
+import unittest
+
+import ops
+import run
+from template import Param, Template
+
+
+def start_sequence(hotend, bed, park_z):
+    return [
+        ops.home_axis(),
+        ops.set_units('mm'),
+        ops.set_bedtemp(bed),
+        ops.wait_hotendtemp(hotend, toolidx=0),
+        ops.zero_extruded_length(),
+        ops.move(z=park_z),
+    ]
+
+
+class TestTemplate(unittest.TestCase):
+    def expected(self, with_checksum, without_comments, **values):
+        sent = []
+        script = run.Run(with_checksum=with_checksum, without_comments=without_comments, writer=sent.append)
+        script.execute(start_sequence(**values))
+        return sent, script.line_no
+
+    def test_matches_run(self):
+        start_seq = Template(start_sequence(Param("hotend"), Param("bed"), Param("park_z")), park_z=10)
+        self.assertEqual(start_seq.names, ("bed", "hotend", "park_z"))
+        for with_checksum in (False, True):
+            for without_comments in (False, True):
+                for hotend, bed in ((210, 60), (0, 0), (185.5, 100)):
+                    sent = []
+                    script = run.Run(with_checksum=with_checksum, without_comments=without_comments, writer=sent.append)
+                    script.execute(start_seq.bind(hotend=hotend, bed=bed))
+                    self.assertEqual((sent, script.line_no),
+                                     self.expected(with_checksum, without_comments, hotend=hotend, bed=bed, park_z=10))
+
+    def test_line_numbers_continue(self):
+        end_seq = Template([ops.set_hotendtemp(Param("temp")), ops.set_fanoff()])
+        sent = []
+        script = run.Run(with_checksum=True, without_comments=True, writer=sent.append)
+        script.execute([ops.get_temp(), end_seq.bind(temp=0), ops.get_temp(), end_seq.bind(temp=0)])
+        self.assertEqual([line.split()[0] for line in sent], [f"N{n}" for n in range(7)])
+        self.assertEqual(script.line_no, 7)
+
+    def test_background_run(self):
+        end_seq = Template([ops.set_hotendtemp(Param("temp")), ops.set_fanoff()])
+        sent = []
+        with run.BackgroundRun(with_checksum=True, writer=sent.append) as script:
+            script.queue(end_seq.bind(temp=0))
+            script.execute(ops.get_temp())
+            script.join()
+        self.assertEqual(len(sent), 4)
+
+    def test_errors(self):
+        t = Template([ops.set_hotendtemp(Param("temp"))])
+        with self.assertRaises(ValueError):
+            t.render()
+        with self.assertRaises(ValueError):
+            t.render(checksum=True, temp=1)
+        with self.assertRaises(ValueError):
+            Template([ops.set_lineno(1)])
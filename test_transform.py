@@ -0,0 +1,89 @@
+#! *python3-tests:doctest-modules*
+
+import unittest
+
+import ops
+import transform
+from codes import Code
+from transform import Affine, Transform
+
+
+class TestTransform(unittest.TestCase):
+    def params(self, commands):
+        return [command.parameters for command in commands]
+
+    def test_translate(self):
+        job = [ops.move(x=1, y=2, z=0.2), ops.move(x=5), ops.extrude(y=7, filament=1)]
+        got = list(Transform(Affine.translation(10, 20, 1))(job))
+        self.assertEqual(self.params(got), [{'X': 11, 'Y': 22, 'Z': 1.2}, {'X': 15}, {'Y': 27, 'E': 1}])
+        self.assertEqual(got[2].code, "G1")
+        # The originals aren't touched.
+        self.assertEqual(job[0].parameters, {'X': 1, 'Y': 2, 'Z': 0.2})
+
+    def test_rotate_absolute(self):
+        job = [ops.move(x=10, y=0), ops.move(y=10)]
+        got = list(Transform(Affine.rotation(90))(job))
+        # Rotation mixes X and Y, so both are emitted even when only one was given.
+        self.assertEqual(self.params(got), [{'X': 0, 'Y': 10}, {'X': -10, 'Y': 10}])
+
+    def test_relative(self):
+        job = [ops.move(x=10, y=10), ops.set_positioning("relative"), ops.move(x=1),
+               ops.set_positioning("absolute"), ops.move(x=20)]
+        got = list(Transform(Affine.translation(100, 100).then(Affine.scaling(2, about=(0, 0, 0))))(job))
+        self.assertEqual(self.params(got), [{'X': 220, 'Y': 220}, {}, {'X': 2}, {}, {'X': 240}])
+
+    def test_scaled_extrusion(self):
+        # Absolute E: 2x in X, 1x in Y. The first move is twice as long, the second the same length.
+        job = [ops.move(x=0, y=0), ops.extrude(x=10, filament=1), ops.extrude(y=10, filament=2),
+               ops.extrude(filament=1.5), ops.zero_extruded_length(), ops.extrude(x=0, filament=1)]
+        got = list(Transform(Affine.scaling(2, 1))(job))
+        self.assertEqual([c.parameters.get('E') for c in got], [None, 2, 3, 2.5, 0, 2])
+        self.assertEqual(got[4].emit(without_comments=True), "G92 E0")
+
+        # Relative E scales each move's own amount.
+        job = [ops.set_extrudemode("relative"), ops.extrude(x=10, y=10, filament=0.5), ops.extrude(filament=-0.2)]
+        got = list(Transform(Affine.scaling(0.5))(job))
+        self.assertEqual([c.parameters.get('E') for c in got], [None, 0.25, -0.2])
+
+        # Rotating doesn't change lengths, so E is left alone.
+        job = [ops.extrude(x=10, filament=0.123456789)]
+        self.assertEqual(list(Transform(Affine.rotation(30))(job))[0].parameters['E'], 0.123456789)
+
+    def test_mirror(self):
+        got = list(Transform(Affine.mirroring(x=True, about=(100, 0, 0)))([ops.move(x=10, y=3)]))
+        self.assertEqual(self.params(got), [{'X': 190, 'Y': 3}])
+
+    def test_z_correction(self):
+        mesh = transform.BedMesh([[0.0, 0.5], [0.0, 0.5]], spacing=(100, 100))
+        job = [ops.move(x=0, y=10, z=0.2), ops.move(x=100),
+               ops.set_positioning("relative"), ops.move(x=-50), ops.move(z=1)]
+        got = list(Transform(z_correction=mesh)(job))
+        self.assertEqual(self.params(got), [{'X': 0, 'Y': 10, 'Z': 0.2}, {'X': 100, 'Z': 0.7}, {},
+                                            {'X': -50, 'Z': -0.25}, {'Z': 1}])
+
+        got = list(Transform(z_correction=transform.z_offset(-0.1))([ops.move(x=1, z=0.3)]))
+        self.assertEqual(self.params(got), [{'X': 1, 'Z': 0.2}])
+
+    def test_set_position_and_home(self):
+        job = [ops.set_axisstepsperunit(x_units=5), ops.zero_extruded_length(), ops.home_axis(x=True), ops.move(y=1)]
+        got = list(Transform(Affine.rotation(180))(job))
+        self.assertEqual(self.params(got), [{'X': -5, 'Y': 0}, {'E': 0}, {'X': ''}, {'X': 0, 'Y': -1}])
+
+    def test_text_and_passthrough(self):
+        got = list(Transform(Affine.translation(x=1))(["G1 X1 E2", ops.get_temp(), ops.move(feed_rate=10)]))
+        self.assertEqual([c.code for c in got], ["G1", "M105", "G0"])
+        self.assertEqual(self.params(got), [{'X': 2, 'E': '2'}, {}, {'F': 600}])
+
+    def test_arcs(self):
+        got = list(Transform(Affine.translation(x=1))([Code("G2", x=1, y=1, i=1)]))
+        self.assertEqual(self.params(got), [{'X': 2, 'Y': 1, 'I': 1}])
+        with self.assertRaises(ValueError):
+            list(Transform(Affine.rotation(90))([Code("G2", x=1, y=1, i=1)]))
+
+    def test_tile(self):
+        job = [ops.move(x=1, y=1, z=0.2), ops.set_positioning("relative"), ops.extrude(x=10, filament=1)]
+        got = list(transform.tile(job, [(0, 0), (50, 0), (0, 50)], safe_z=5))
+        self.assertEqual(len(got), 3 + 2 * (4 + 3))
+        lines = [c.emit(without_comments=True) for c in got]
+        self.assertEqual(lines[3:10], ["G90", "G92 E0", "G0 Z5", "G0 X51 Y1", "G0 X51 Y1 Z0.2", "G91", "G1 X10 E1"])
+        self.assertEqual(lines[13], "G0 X1 Y51")
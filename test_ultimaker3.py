@@ -0,0 +1,56 @@
+#! *python3-tests:doctest-modules*
+
+import os
+import tempfile
+import unittest
+
+import ops
+import ultimaker3
+
+
+# Stand-in for ssh: '$0' receives user@host and '$1' the remote command, which we run locally.
+FAKE_SSH = """sh -c 'exec sh -c "$1"'"""
+
+
+class TestUpload(unittest.TestCase):
+    def test_upload(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote_path = os.path.join(tmpdir, "job.gcode")
+            printer = ultimaker3.Ultimaker3("printer", "ultimaker", ssh_cmd=FAKE_SSH)
+            stats = printer.upload([ops.home_axis(), ops.move(x=1, y=2), "G0 X3 ;comment"],
+                                   remote_path=remote_path, start_cmd="cp {path} {path}.started")
+
+            with open(remote_path + ".started") as started:
+                self.assertEqual(started.read(), "M110 N1\nG28\nG0 X1 Y2\nG0 X3\n")
+            self.assertEqual(stats.lines, 4)
+            self.assertEqual(stats.raw_bytes, os.path.getsize(remote_path))
+            self.assertGreater(stats.sent_bytes, 0)
+
+    def test_upload_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source, remote_path = os.path.join(tmpdir, "part.gcode"), os.path.join(tmpdir, "job.gcode")
+            with open(source, "w") as gcode:
+                gcode.write(";FLAVOR:Marlin\nG28\n\n    ;indented comment\n\tG0 X1 ;move\nM117 Layer 1 of 100\nG1 X1 X2\n")
+            ultimaker3.main(["--ssh", FAKE_SSH, "--upload", source, "--remote-path", remote_path, "printer"])
+
+            with open(remote_path) as uploaded:
+                # Existing gcode goes over as written, not re-parsed.
+                self.assertEqual(uploaded.read(), "G28\nG0 X1\nM117 Layer 1 of 100\nG1 X1 X2\n")
+
+    def test_upload_large(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote_path = os.path.join(tmpdir, "job.gcode")
+            printer = ultimaker3.Ultimaker3("printer", "ultimaker", ssh_cmd=FAKE_SSH)
+            stats = printer.upload((ops.move(x=i % 200, y=i // 200 + 1) for i in range(20000)),
+                                   remote_path=remote_path, with_checksum=True)
+            self.assertEqual(stats.lines, 20001)
+            self.assertLess(stats.sent_bytes, stats.raw_bytes)
+            with open(remote_path) as job:
+                lines = job.read().splitlines()
+            self.assertEqual(len(lines), 20001)
+            self.assertTrue(lines[-1].startswith("N20000 G0 X199 Y100*"))
+
+    def test_upload_failure(self):
+        printer = ultimaker3.Ultimaker3("printer", "ultimaker", ssh_cmd=FAKE_SSH)
+        with self.assertRaises(RuntimeError):
+            printer.upload([ops.home_axis()], remote_path="/nonexistent/dir/job.gcode")
@@ -0,0 +1,357 @@
+#! *python3:doctest-modules*
+
+"""
+Geometric transforms for command streams.
+
+A Transform applies an affine transform (translate, scale, rotate about Z, mirror) plus an
+optional Z correction, such as a BedMesh or a plain offset, to the X/Y/Z of every move in a
+stream of commands. It tracks G90/G91 so absolute moves are mapped as points and relative moves
+as vectors, and G92 as a redefinition of the current position. When the transform changes lengths
+in XY (any scaling), E is scaled by how much each move's XY length changed, so the same amount of
+filament is laid per mm; M82/M83 are tracked for that.
+
+tile() uses it to lay out copies of the same job across the bed, with a safe travel between them.
+
+    import ops, run, transform
+
+    flip = transform.Affine.mirroring(x=True, about=(110, 0, 0))
+    script = run.Run()
+    script.execute(transform.Transform(flip)(sliced_job))
+    script.execute(transform.tile(sliced_job, [(0, 0), (60, 0), (120, 0)], safe_z=20))
+
+The work is done in a single pass with the matrix coefficients hoisted into locals.
+"""
+
+import math
+
+from math import floor
+
+import ops
+import registry
+import run
+
+
+####
+# Constants
+#
+AXES = ('X', 'Y', 'Z')
+""" Codes whose X/Y/Z are positions: moves, arcs and set-position """
+MOVES = registry.modal_codes('position', 'move')
+ARCS = ('G2', 'G3')     # no helper makes these, so they aren't in the table
+SET_POSITION, = registry.modal_codes('position', 'set')
+HOME, = registry.modal_codes('position', 'home')
+ABSOLUTE, RELATIVE = registry.modes('positioning')['absolute'], registry.modes('positioning')['relative']
+ABSOLUTE_E, RELATIVE_E = registry.modes('extrusion')['absolute'], registry.modes('extrusion')['relative']
+
+
+# -----------------------------------------------------------------------------
+#
+class Affine(object):
+    """ A 3d affine transform, held as three rows of (x, y, z, translation) coefficients.
+
+    >>> Affine.translation(x=10)(1, 2, 3)
+    (11.0, 2.0, 3.0)
+    >>> Affine.scaling(2, about=(10, 10, 0))(11, 12, 3)
+    (12.0, 14.0, 3.0)
+    >>> Affine.translation(x=10).then(Affine.scaling(x=2))(1, 0, 0)
+    (22.0, 0.0, 0.0)
+    """
+    def __init__(self, rows=((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0))):
+        self.rows = tuple(tuple(float(v) for v in row) for row in rows)
+
+    @classmethod
+    def translation(cls, x=0, y=0, z=0):
+        """ Shift by x, y, z """
+        return cls(((1, 0, 0, x), (0, 1, 0, y), (0, 0, 1, z)))
+
+    @classmethod
+    def scaling(cls, x=1, y=None, z=1, about=(0, 0, 0)):
+        """ Scale about a point; y defaults to the x scale, z is left alone unless given """
+        y = x if y is None else y
+        ax, ay, az = about
+        return cls(((x, 0, 0, ax - ax * x), (0, y, 0, ay - ay * y), (0, 0, z, az - az * z)))
+
+    @classmethod
+    def rotation(cls, degrees, about=(0, 0)):
+        """ Rotate counter-clockwise about a point in the XY plane
+
+        >>> [round(v, 6) for v in Affine.rotation(90, about=(10, 10))(20, 10, 0)]
+        [10.0, 20.0, 0.0]
+        """
+        radians = math.radians(degrees)
+        cos, sin = math.cos(radians), math.sin(radians)
+        ax, ay = about
+        return cls(((cos, -sin, 0, ax - ax * cos + ay * sin),
+                    (sin, cos, 0, ay - ax * sin - ay * cos),
+                    (0, 0, 1, 0)))
+
+    @classmethod
+    def mirroring(cls, x=False, y=False, z=False, about=(0, 0, 0)):
+        """ Mirror the selected axes about a point, e.g. x=True flips left-to-right
+
+        >>> Affine.mirroring(x=True, about=(100, 0, 0))(10, 5, 0)
+        (190.0, 5.0, 0.0)
+        """
+        return cls.scaling(-1 if x else 1, -1 if y else 1, -1 if z else 1, about=about)
+
+    def then(self, other):
+        """ Compose: the transform that applies this one and then 'other' """
+        rows = []
+        for brow in other.rows:
+            row = [sum(brow[k] * self.rows[k][j] for k in range(3)) for j in range(3)]
+            row.append(sum(brow[k] * self.rows[k][3] for k in range(3)) + brow[3])
+            rows.append(row)
+        return Affine(rows)
+
+    def is_length_preserving(self):
+        """ True if lengths in XY are unchanged: only translating, rotating and mirroring
+
+        >>> Affine.rotation(30).then(Affine.mirroring(x=True)).is_length_preserving()
+        True
+        >>> Affine.scaling(2).is_length_preserving()
+        False
+        """
+        (a, b, _, _), (d, e, _, _), _ = self.rows
+        return (math.isclose(a * a + d * d, 1) and math.isclose(b * b + e * e, 1)
+                and math.isclose(a * b + d * e, 0, abs_tol=1e-9))
+
+    def is_translation(self):
+        """ True if this only moves things about, without scaling/rotating/mirroring """
+        return all(row[:3] == unit for row, unit in zip(self.rows, ((1, 0, 0), (0, 1, 0), (0, 0, 1))))
+
+    def __call__(self, x, y, z):
+        (a, b, c, tx), (d, e, f, ty), (g, h, i, tz) = self.rows
+        return (a * x + b * y + c * z + tx, d * x + e * y + f * z + ty, g * x + h * y + i * z + tz)
+
+    def __eq__(self, rhs):
+        return self.rows == rhs.rows
+
+    def __repr__(self):
+        return f"<Affine({self.rows})>"
+
+
+# -----------------------------------------------------------------------------
+#
+class BedMesh(object):
+    """ Z correction from a regular grid of probed heights, bilinearly interpolated and clamped
+    to the edges of the grid. Pass as Transform(z_correction=...).
+
+    >>> mesh = BedMesh(heights=[[0.0, 0.2], [0.1, 0.3]], spacing=(100, 100))
+    >>> [round(mesh(x, y), 6) for x, y in ((0, 0), (100, 0), (50, 50), (500, 500))]
+    [0.0, 0.2, 0.15, 0.3]
+
+    :param heights: Rows of heights, heights[row][col] at (origin.x + col*spacing.x, origin.y + row*spacing.y)
+    :param spacing: Distance between probe points in X and Y
+    :param origin: Bed coordinate of heights[0][0]
+    """
+    def __init__(self, heights, spacing, origin=(0, 0)):
+        self.heights = [[float(h) for h in row] for row in heights]
+        self.spacing = spacing
+        self.origin = origin
+
+    def __call__(self, x, y):
+        heights = self.heights
+        fx = min(max((x - self.origin[0]) / self.spacing[0], 0.0), len(heights[0]) - 1)
+        fy = min(max((y - self.origin[1]) / self.spacing[1], 0.0), len(heights) - 1)
+        col, row = min(int(fx), len(heights[0]) - 2), min(int(fy), len(heights) - 2)
+        fx, fy = fx - col, fy - row
+        lower, upper = heights[row], heights[row + 1]
+        return ((lower[col] * (1 - fx) + lower[col + 1] * fx) * (1 - fy)
+                + (upper[col] * (1 - fx) + upper[col + 1] * fx) * fy)
+
+
+def z_offset(offset):
+    """ A constant Z correction, e.g. to compensate for a different nozzle """
+    return lambda x, y: offset
+
+
+def _rounder(precision):
+    """ Make a function that rounds for emitting, dropping the '.0' from whole numbers. Dividing
+    the rounded integer by a power of ten gives the shortest repr, and is much cheaper than round().
+
+    >>> rnd = _rounder(3)
+    >>> rnd(1.23456), rnd(-1.23456), rnd(2.0000001), rnd(0.1 * 3)
+    (1.235, -1.235, 2, 0.3)
+    """
+    scale = 10 ** precision
+    def rnd(value):
+        value = floor(value * scale + 0.5)
+        return value / scale if value % scale else value // scale
+    return rnd
+
+
+# -----------------------------------------------------------------------------
+#
+class Transform(object):
+    """ Applies an Affine and an optional Z correction to the positions in a command stream.
+
+    >>> shift = Transform(Affine.translation(x=10, y=5))
+    >>> list(shift([ops.move(x=1, y=1), ops.set_positioning("relative"), ops.move(x=1)]))
+    [<Code(code=G0, X=11, Y=6)>, <Code(code=G91, comment="set pos_mode positioning mode")>, <Code(code=G0, X=1)>]
+    >>> double = Transform(Affine.scaling(2))
+    >>> list(double([ops.extrude(x=10, filament=1), ops.extrude(x=15, filament=1.5)]))
+    [<Code(code=G1, X=20, E=2)>, <Code(code=G1, X=30, E=3)>]
+
+    :param affine: The Affine to apply, default is the identity
+    :param z_correction: Callable (x, y) -> z adjustment, evaluated at the transformed position
+    :param position: The starting (and homed) position, in untransformed coordinates
+    :param precision: Decimal places in the transformed coordinates
+    """
+    def __init__(self, affine=None, z_correction=None, position=(0.0, 0.0, 0.0), precision=4):
+        self.affine = affine or Affine()
+        self.z_correction = z_correction
+        self.position = position
+        self.precision = precision
+
+    def __call__(self, commands):
+        """ Generate the transformed commands; Codes are copied, the originals are left alone. """
+        (a, b, c, tx), (d, e, f, ty), (g, h, i, tz) = rows = self.affine.rows
+        correct, precision = self.z_correction, self.precision
+        arcs_ok = self.affine.is_translation() and not correct
+        scale_e = not self.affine.is_length_preserving()
+
+        # Which input axes each output axis depends on: an output axis gets (re)emitted
+        # whenever one of those is given. Tabulated by a bitmask of the given axes, X=1, Y=2, Z=4.
+        depends = [{axis for axis, coeff in zip(AXES, row[:3]) if coeff} for row in rows]
+        if correct:
+            depends[2] |= depends[0] | depends[1]
+        emitted = [tuple(idx for idx, needs in enumerate(depends) if needs & {axis for bit, axis in enumerate(AXES) if mask & (1 << bit)})
+                   for mask in range(8)]
+        rnd = _rounder(precision)
+
+        px, py, pz = self.position
+        relative = relative_e = False
+        e_in = e_out = 0.0      # the extruder position as given, and as we've emitted it
+        rnd_e = _rounder(5)
+
+        def extrude(value, factor):
+            """ The E to emit for a move whose XY length changed by 'factor' """
+            nonlocal e_in, e_out
+            value = float(value)
+            if relative_e:
+                return rnd_e(value * factor)
+            e_out += (value - e_in) * factor
+            e_in = value
+            return rnd_e(e_out)
+        last_z = correct(a * px + b * py + c * pz + tx, d * px + e * py + f * pz + ty) if correct else 0.0
+
+        for command in commands:
+            if isinstance(command, str):
+                command = run.parse_command(command)
+                if command is None:
+                    continue
+            code, params = command.code, command.parameters
+
+            if code not in MOVES:
+                if code == ABSOLUTE or code == RELATIVE:
+                    relative = code == RELATIVE
+                    yield command
+                    continue
+                if code == ABSOLUTE_E or code == RELATIVE_E:
+                    relative_e = code == RELATIVE_E
+                    yield command
+                    continue
+                if code == HOME:
+                    homed = [axis for axis in AXES if axis in params] or AXES
+                    hx, hy, hz = self.position
+                    px, py, pz = (hx if 'X' in homed else px), (hy if 'Y' in homed else py), (hz if 'Z' in homed else pz)
+                    if correct:
+                        last_z = correct(a * px + b * py + c * pz + tx, d * px + e * py + f * pz + ty)
+                    yield command
+                    continue
+                if code in ARCS:
+                    if not arcs_ok:
+                        raise ValueError(f"{code} arcs can only be translated, not scaled/rotated/mirrored/corrected")
+                elif code != SET_POSITION:
+                    yield command
+                    continue
+
+            x, y, z = params.get('X'), params.get('Y'), params.get('Z')
+            mask = (x is not None) | (y is not None) << 1 | (z is not None) << 2
+            extruding = scale_e and 'E' in params
+            if code == SET_POSITION:
+                if 'E' in params:
+                    e_in = e_out = float(params['E'])
+                extruding = False
+            if not mask:
+                # Feed rate or extruder only; an absolute E still has to follow what we've emitted.
+                yield command.copy(dict(params, E=extrude(params['E'], 1.0))) if extruding else command
+                continue
+            start_x, start_y = px, py
+
+            if relative and code != SET_POSITION:
+                dx, dy, dz = (0.0 if x is None else float(x)), (0.0 if y is None else float(y)), (0.0 if z is None else float(z))
+                px, py, pz = px + dx, py + dy, pz + dz
+                out = (a * dx + b * dy + c * dz, d * dx + e * dy + f * dz, g * dx + h * dy + i * dz)
+                if correct:
+                    new_z = correct(a * px + b * py + c * pz + tx, d * px + e * py + f * pz + ty)
+                    out = (out[0], out[1], out[2] + new_z - last_z)
+                    last_z = new_z
+            else:
+                if x is not None:
+                    px = float(x)
+                if y is not None:
+                    py = float(y)
+                if z is not None:
+                    pz = float(z)
+                out = (a * px + b * py + c * pz + tx, d * px + e * py + f * pz + ty, g * px + h * py + i * pz + tz)
+                if correct:
+                    last_z = correct(out[0], out[1])
+                    out = (out[0], out[1], out[2] + last_z)
+
+            # Coordinates first, in XYZ order, then whatever else the command had (F, E, ...)
+            parameters = {AXES[idx]: rnd(out[idx]) for idx in emitted[mask]}
+            for key, value in params.items():
+                if key not in parameters and key not in AXES:
+                    parameters[key] = value
+            if extruding:
+                dx, dy = px - start_x, py - start_y
+                length = math.hypot(dx, dy)
+                parameters['E'] = extrude(params['E'], math.hypot(a * dx + b * dy, d * dx + e * dy) / length if length else 1.0)
+            yield command.copy(parameters)
+
+
+def tile(commands, offsets, safe_z, affine=None, z_correction=None, position=(0.0, 0.0, 0.0)):
+    """ Generate one copy of 'commands' per (x, y) offset. Between copies, switch to absolute
+    positioning, zero the extruder, lift to safe_z and travel to where the next copy starts.
+
+    >>> job = [ops.move(x=1, y=1), ops.extrude(x=2, filament=1)]
+    >>> for code in tile(job, [(0, 0), (50, 0)], safe_z=10):
+    ...     print(code.emit(without_comments=True))
+    G0 X1 Y1
+    G1 X2 E1
+    G90
+    G92 E0
+    G0 Z10
+    G0 X51 Y1
+    G0 X51 Y1
+    G1 X52 E1
+
+    :param affine: Applied to every copy before its offset
+    """
+    commands = list(commands)
+    affine = affine or Affine()
+    for idx, (x, y) in enumerate(offsets):
+        copy = Transform(affine.then(Affine.translation(x, y)), z_correction=z_correction, position=position)
+        copy = copy(commands)
+        if idx == 0:
+            yield from copy
+            continue
+
+        # Find where this copy starts, so we can travel there above the previous copies.
+        buffered, start = [], None
+        for command in copy:
+            buffered.append(command)
+            if command.code == RELATIVE:
+                break
+            if command.code in MOVES and 'X' in command.parameters and 'Y' in command.parameters:
+                start = command.parameters['X'], command.parameters['Y']
+                break
+
+        yield ops.set_positioning("absolute")
+        yield ops.zero_extruded_length()
+        yield ops.move(z=safe_z)
+        if start is not None:
+            yield ops.move(x=start[0], y=start[1])
+        yield from buffered
+        yield from copy
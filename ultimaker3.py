@@ -27,18 +27,27 @@ Example: (note: verbose commands used, abbreviate per your own level of experien
     > um3.queue(op.set_fanspeed(100))         # QUEUED: 3: set fan to full
     > um3.execute_immediate(op.set_fanspeed(20))  # sends this command right away
     > um3.execute(op.home_all_axis())         # queues a home-all-axis command and then executes the queue
+
+For whole jobs, sending one 'sendgcode' per line costs a prompt round-trip per line. Use the
+bulk mode instead, which compresses the job and streams it to a file on the printer over a
+single ssh channel:
+
+    > python ultimaker3.py --upload part.gcode --start "<command to print {path}>" pickles.my.net
 """
 
-import code, ops, run
+import code, ops, registry, run
 
 import IPython
 import argparse
 import logging
 import re
+import shlex
 import subprocess
 import sys
 import time
+import zlib
 
+from collections import namedtuple
 from inspect import cleandoc, signature
 from threading import Thread
 from queue import Queue, Empty
@@ -54,6 +63,61 @@ def ssh_reader(stream, to_queue):
             to_queue.put(line.decode())
 
 
+""" Result of a bulk upload: uncompressed and on-the-wire byte counts, and the time taken. """
+UploadStats = namedtuple("UploadStats", ("lines", "raw_bytes", "sent_bytes", "seconds"))
+
+
+class GzipStreamWriter(run.Writer):
+    """ Writer that gzip-compresses lines directly into a binary stream (e.g. a pipe), without
+    holding the whole job in memory.
+
+    >>> import gzip, io
+    >>> out = io.BytesIO()
+    >>> w = GzipStreamWriter(out)
+    >>> w("G28"); w("M105")
+    >>> w.close()
+    >>> gzip.decompress(out.getvalue())
+    b'G28\\nM105\\n'
+    >>> w.lines, w.raw_bytes, w.sent_bytes == len(out.getvalue())
+    (2, 9, True)
+    """
+    def __init__(self, outstream, level=6, chunk_size=64 * 1024):
+        self.outstream = outstream
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip framing
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.pending_size = 0
+        self.lines = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def __call__(self, line):
+        """ Buffer a line, compressing in chunks so we aren't calling into zlib per line """
+        data = (line + "\n").encode()
+        self.pending.append(data)
+        self.pending_size += len(data)
+        self.lines += 1
+        if self.pending_size >= self.chunk_size:
+            self._compress()
+
+    def _compress(self):
+        data = b"".join(self.pending)
+        self.pending, self.pending_size = [], 0
+        self.raw_bytes += len(data)
+        self._send(self.compressor.compress(data))
+
+    def _send(self, data):
+        if data:
+            self.outstream.write(data)
+            self.sent_bytes += len(data)
+
+    def close(self):
+        """ Flush any buffered lines and terminate the gzip stream """
+        self._compress()
+        self._send(self.compressor.flush())
+        self.outstream.flush()
+
+
 class Ultimaker3(run.GriffinWriter):
     def __init__(self, host_addr, user, identity=None, ssh_cmd="ssh", connect_timeout=20):
         super().__init__(self)
@@ -112,6 +176,61 @@ class Ultimaker3(run.GriffinWriter):
             if not self.connected:
                 self.ssh_client.kill()
 
+    def ssh_args(self, remote_cmd):
+        """ Build the argument list for running a single command on the printer """
+        return shlex.split(self.ssh_cmd) + shlex.split(self.identity) + [f"{self.user}@{self.host_addr}", remote_cmd]
+
+    def upload(self, commands, remote_path="/tmp/pymcode.gcode", start_cmd=None, with_checksum=False):
+        """ Bulk mode: emit commands via a Run into a gzip stream that is piped over a single ssh
+        channel into 'remote_path' on the printer, rather than doing a round trip per line.
+
+        :param commands: Anything Run.execute accepts (Codes, text lines, or an iterable of them),
+                         consumed lazily. Text is sent as written, less comments and blank lines,
+                         unless with_checksum needs Run to number it.
+        :param remote_path: Where to write the (decompressed) job on the printer
+        :param start_cmd: Optional shell command run on the printer once the file is complete,
+                          with '{path}' replaced by remote_path, e.g. to start the print
+        :param with_checksum: Emit line numbers and checksums into the file
+        :returns: UploadStats
+        """
+        path = shlex.quote(remote_path)
+        remote_cmd = f"gzip -dc > {path}"
+        if start_cmd:
+            remote_cmd += " && " + start_cmd.format(path=path)
+
+        started = time.time()
+        client = subprocess.Popen(self.ssh_args(remote_cmd), stdin=subprocess.PIPE, close_fds=IS_POSIX)
+        writer = GzipStreamWriter(client.stdin)
+        try:
+            job = run.Run(with_checksum=with_checksum, without_comments=True, writer=writer, keep_history=False)
+            if isinstance(commands, run.SINGLE_COMMANDS):
+                commands = (commands,)
+            for command in commands:
+                if isinstance(command, str) and not with_checksum:
+                    text = command.partition(';')[0].strip()
+                    if text:
+                        writer(text)
+                else:
+                    job.execute_immediate((command,))
+            writer.close()
+        except BrokenPipeError:
+            pass    # the remote end went away early, the exit code will tell us why
+        finally:
+            # An incomplete gzip stream makes the remote gzip fail, so a partial job is never started.
+            try:
+                client.stdin.close()
+            except BrokenPipeError:
+                pass
+            result = client.wait()
+        if result != 0:
+            raise RuntimeError(f"upload to {self.host_addr}:{remote_path} failed: exit code {result}")
+
+        stats = UploadStats(writer.lines, writer.raw_bytes, writer.sent_bytes, time.time() - started)
+        logging.info("uploaded %d lines (%d bytes, %d compressed) in %.2fs: %.1f KB/s",
+                     stats.lines, stats.raw_bytes, stats.sent_bytes, stats.seconds,
+                     stats.raw_bytes / 1024 / max(stats.seconds, 1e-6))
+        return stats
+
     def __call__(self, line):
         """ Implement the Writer protocol """
         pstdin, pstdout = self.ssh_client.stdin, self.ssh_client.stdout
@@ -142,10 +261,9 @@ class Ultimaker3(run.GriffinWriter):
 def cmd_help(args):
     if not args or args == "all":
         print("Repl-Commands: exit/quit, go, queue, help.")
-        print("To queue raw gcode, start with a ' or \" character.")
+        print("To queue raw gcode, type it or start with a ' or \" character.")
         print("G/MCode Commands:")
-        helpCheck = re.compile("^[a-z]").match
-        print(", ".join(cmd for cmd in dir(ops) if helpCheck(cmd)))
+        print(", ".join(registry.helpers()))
     else:
         print()
         for arg in args:
@@ -157,14 +275,17 @@ def cmd_help(args):
                 print("List queued commands")
             elif arg == "help":
                 print("This.")
+            elif registry.spec_for(arg) or registry.TOOL_CODE.match(arg):
+                print(f"{arg}: use {registry.to_helper(arg)[0]}")
             else:
-                fn = getattr(ops, arg, None)
-                if not fn:
+                try:
+                    fn = registry.helper(arg)
+                except ValueError:
                     print("Unrecognized command:", arg)
                 else:
                     print("Ok.")
-                    print("===", arg, str(signature(fn))[1:-1])
-                    print(re.sub(r'^', cleandoc(fn.__doc__), '    '), re.M)
+                    print("===", arg, str(signature(fn))[1:-1], " ".join(registry.helper_codes(arg)))
+                    print(re.sub(r'^', '    ', cleandoc(fn.__doc__ or ''), flags=re.M))
             print()
 
 
@@ -183,6 +304,9 @@ def main(arglist):
     parser.add_argument("--ssh",  "-S",     type=str, help="SSH Command [default: 'ssh']", default='ssh')
     parser.add_argument("--identity", "-i", type=str, help="Identity file to use [default: None]", default=None)
     parser.add_argument("--verbose", "-v",  action="count", help="Increased verbosity", default=0)
+    parser.add_argument("--upload",         type=str, help="Bulk-upload a gcode file instead of starting the repl", default=None)
+    parser.add_argument("--remote-path",    type=str, help="Upload destination [default: /tmp/pymcode.gcode]", default="/tmp/pymcode.gcode")
+    parser.add_argument("--start",          type=str, help="Command to run on the printer after upload, {path} is the file", default=None)
     parser.add_argument("printer",          type=str, help="Network name/address of the printer")
 
     args = parser.parse_args(arglist)
@@ -191,7 +315,14 @@ def main(arglist):
     log_level = log_levels[min(args.verbose, len(log_levels)-1)]
     logging.basicConfig(level=log_level)
 
-    with Ultimaker3(host_addr=args.printer, user=args.user, identity=args.identity) as writer:
+    if args.upload:
+        printer = Ultimaker3(host_addr=args.printer, user=args.user, identity=args.identity, ssh_cmd=args.ssh)
+        with open(args.upload) as gcode:
+            stats = printer.upload(gcode, remote_path=args.remote_path, start_cmd=args.start)
+        print(f"Uploaded {stats.lines} lines ({stats.raw_bytes} bytes, {stats.sent_bytes} sent) in {stats.seconds:.2f}s")
+        return
+
+    with Ultimaker3(host_addr=args.printer, user=args.user, identity=args.identity, ssh_cmd=args.ssh) as writer:
         um3 = run.Run(with_checksum=False, writer=writer)
         globals()["um3"] = um3
         IPython.embed()
@@ -214,22 +345,22 @@ def repl():
         elif cmd == "help":
             cmd_help(args)
         else:
-            if cmd[0] == '"' or cmd[0] == "'":
-                cmd = cmd.strip(cmd[0])
+            if cmd[0] == '"' or cmd[0] == "'" or registry.spec_for(cmd) or registry.TOOL_CODE.match(cmd):
+                cmd = registry.parse(line.strip(line[0]) if cmd[0] in '"\'' else line)
+                try:
+                    registry.validate(cmd)
+                except ValueError as e:
+                    print("!! Warning:", e)
             else:
-                atoms = cmd.split(r'\s+')
-                function, args = atoms[0], atoms[1:]
                 # lookup the command name
-                func = getattr(ops, function, None)
-                if not func:
-                    print("XX Unknown command: %s" % function)
+                try:
+                    func = registry.helper(cmd)
+                except ValueError:
+                    print("XX Unknown command: %s" % cmd)
                     continue
-                kwargs = {}
-                for arg in args:
-                    key, value = arg.split('=')
-                    kwargs[key] = value
+                kwargs = dict(arg.split('=', 1) for arg in args)
                 print("kwargs =", kwargs)
-                cmd = func(**kwargs)
+                cmd = func(**registry.convert_args(cmd, kwargs))
             print("Queueing:", cmd)
             um3.queue(cmd)
 